@@ -154,6 +154,55 @@ class ErrandService:
             logger.error(f"Error creating errand: {str(e)}")
             raise e
 
+    def create_errands_bulk(self, user_id: int, records: List[Dict[str, Any]]) -> int:
+        """Create many errands in a single multi-row INSERT, returns the number created"""
+        try:
+            columns = set(Errand.__table__.columns.keys()) - {'id', 'user_id', 'created_at', 'updated_at'}
+            rows = []
+            for index, record in enumerate(records):
+                record = dict(record)
+                # Relationships are reciprocal and need the ORM path in create_errand
+                if record.get('complementary_errands') or record.get('conflicting_errands'):
+                    raise ValueError(f"Errand {index}: complementary/conflicting errands are not supported in bulk creation")
+
+                unknown_fields = set(record) - columns
+                if unknown_fields:
+                    raise ValueError(f"Errand {index}: unknown fields: {', '.join(sorted(unknown_fields))}")
+
+                alternative_locations = record.get('alternative_locations')
+                if alternative_locations is not None and not isinstance(alternative_locations, str):
+                    record['alternative_locations'] = json.dumps(alternative_locations)
+
+                # An empty form field means no date, as in create_errand
+                if 'starting_monday' in record and not record['starting_monday']:
+                    record['starting_monday'] = None
+                elif isinstance(record.get('starting_monday'), str):
+                    try:
+                        record['starting_monday'] = datetime.strptime(record['starting_monday'], '%Y-%m-%d').date()
+                    except ValueError:
+                        raise ValueError(f"Errand {index}: invalid starting_monday format. Use YYYY-MM-DD")
+
+                is_valid, error = self.validate_errand(**record)
+                if not is_valid:
+                    raise ValueError(f"Errand {index}: {error}")
+
+                record['user_id'] = user_id
+                rows.append(record)
+
+            if rows:
+                # Pad every row to the same keys so SQLAlchemy can batch them into one executemany
+                table_columns = Errand.__table__.columns
+                defaults = {key: table_columns[key].default.arg if table_columns[key].default is not None else None
+                            for key in set().union(*rows)}
+                rows = [{**defaults, **record} for record in rows]
+                self.session.execute(Errand.__table__.insert(), rows)
+            self.session.commit()
+            return len(rows)
+        except Exception as e:
+            self.session.rollback()
+            logger.error(f"Error creating errands in bulk: {str(e)}")
+            raise e
+
     def update_errand(self, errand_id: int, complementary_errands: List[int] = None, **kwargs) -> Optional[Errand]:
         """Update an existing errand"""
         try:
@@ -1,4 +1,5 @@
 import unittest
+from unittest import mock
 from flask import Flask
 from flask.testing import FlaskClient
 from web_app import app, get_current_user, validate_address_with_bias
@@ -263,6 +264,24 @@ class TestWebApp(unittest.TestCase):
             with client.session_transaction() as sess:
                 self.assertEqual(sess.get('user_address'), "1 Hacker Wy, Menlo Park, CA 94025, USA")
 
+    def test_validate_address_cache(self):
+        """Test that a cached validation is reused only while the user's home address is unchanged"""
+        result = {'valid': True, 'address': 'Some Place', 'location': {'latitude': 1, 'longitude': 2}}
+        with self.app as client, mock.patch('web_app.validate_address_with_bias', return_value=result) as validate:
+            with client.session_transaction() as sess:
+                sess['user_id'] = self.user_id
+
+            for _ in range(2):
+                response = client.post('/validate_address', data={'address': 'Some Place'})
+                self.assertEqual(json.loads(response.data), result)
+            self.assertEqual(validate.call_count, 1)
+
+            # A new home address changes the location bias, so the cached result is stale
+            self.test_user.home_address = '1 Hacker Wy, Menlo Park, CA 94025, USA'
+            self.db_session.commit()
+            client.post('/validate_address', data={'address': 'Some Place'})
+            self.assertEqual(validate.call_count, 2)
+
     def test_home_address_validation(self):
         """Test home address validation and saving"""
         # Simulate login first
@@ -339,7 +358,45 @@ class TestWebApp(unittest.TestCase):
             errand = self.db_session.query(Errand).filter_by(title='Test Errand 2').first()
             self.assertIsNotNone(errand)
             self.assertIsNone(errand.complementary_errands)
-    
+
+    def test_bulk_errand_creation(self):
+        """Test creating several errands in one request"""
+        with self.app as client:
+            # Simulate login
+            with client.session_transaction() as sess:
+                sess['user_id'] = self.user_id
+
+            base = {
+                'location_type': 'name',
+                'location_name': 'Test Location',
+                'access_type': 'drive',
+                'valid_start_window': '0900',
+                'valid_end_window': '1700',
+                'estimated_duration': 30,
+                'repetition': 'none'
+            }
+            response = client.post('/create_errands_bulk', json=[
+                dict(base, title='Test Bulk Errand 1'),
+                dict(base, title='Test Bulk Errand 2', priority=1, starting_monday='')
+            ])
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_json()['created'], 2)
+
+            errands = self.db_session.query(Errand).filter(Errand.title.like('Test Bulk Errand%')).order_by(Errand.title).all()
+            self.assertEqual(len(errands), 2)
+            self.assertEqual(errands[0].user_id, self.user_id)
+            self.assertEqual(errands[0].priority, 3)  # Default priority
+            self.assertEqual(errands[1].priority, 1)
+            self.assertIsNone(errands[1].starting_monday)  # Empty form field stored as no date
+
+            # One invalid errand rejects the whole batch
+            response = client.post('/create_errands_bulk', json=[
+                dict(base, title='Test Bulk Errand 3'),
+                dict(base, title='Test Bulk Errand 4', access_type='fly')
+            ])
+            self.assertEqual(response.status_code, 400)
+            self.assertIsNone(self.db_session.query(Errand).filter_by(title='Test Bulk Errand 3').first())
+
     def test_errand_relationships(self):
         """Test complementary errand relationships"""
         with self.app as client:
@@ -292,29 +292,43 @@ def validate_address_with_bias(address, user=None):
 
 @app.route('/validate_address', methods=['POST'])
 def validate_address():
-    db_session = None
     try:
-        address = request.form.get('address')
+        if request.is_json:
+            payload = request.get_json(silent=True) or {}
+            address = payload.get('address')
+        else:
+            address = request.form.get('address')
+        address = (address or '').strip()
+
+        # Reject incomplete input before touching the database or Places API;
+        # autocomplete UIs hit this endpoint on every keystroke
+        if len(address) < 2:
+            return jsonify(validate_address_with_bias(address))
+
+        if 'user_id' not in session:
+            logger.warning("Validate address attempted with no user")
+            return jsonify({'valid': False, 'error': 'User not found'})
+
         user = get_current_user()
         if not user:
             logger.warning("Validate address attempted with no user")
             return jsonify({'valid': False, 'error': 'User not found'})
-        
-        db_session = Session()
-        return jsonify(validate_address_with_bias(address, user))
-            
-    except UnboundLocalError as e:
-        if 'db_session' in str(e):
-            return handle_db_error(e)
-        raise
+
+        # Repeated validation of the same address is answered from the session, as long as the
+        # result was biased by this user's current home address
+        cache_key = [user.id, user.home_address, address]
+        cached = session.get('last_validated')
+        if cached and cached['key'] == cache_key:
+            return jsonify(cached['result'])
+
+        result = validate_address_with_bias(address, user)
+        if result.get('valid'):
+            session['last_validated'] = {'key': cache_key, 'result': result}
+        return jsonify(result)
+
     except Exception as e:
         logger.error(f"Error in validate_address route: {str(e)}")
-        if db_session:
-            db_session.rollback()
         return jsonify({'valid': False, 'error': str(e)})
-    finally:
-        if db_session:
-            db_session.close()
 
 def serialize_errand(errand):
     """Serialize an errand object to JSON"""
@@ -378,13 +392,15 @@ def errands(errand_id=None):
         # Handle GET request
         if request.method == 'GET':
             if errand_id:
-                # Get specific errand for editing
-                errand = errand_service.get_errand_by_id(errand_id)
-                if not errand or errand.user_id != user.id:
+                # Get specific errand for editing; the user's errand list already
+                # contains it, so pick it out instead of issuing a second query
+                errands = errand_service.get_user_errands(user.id)
+                errand = next((e for e in errands if e.id == errand_id), None)
+                if not errand:
                     logger.warning(f"Errand {errand_id} not found or not owned by user {user.id}")
                     return jsonify({'error': 'Errand not found'}), 404
                 logger.info(f"Retrieved errand {errand_id} for editing")
-                return render_template('errands.html', errand=errand, errands=errand_service.get_user_errands(user.id))
+                return render_template('errands.html', errand=errand, errands=errands)
             else:
                 # Get all errands
                 errands = errand_service.get_user_errands(user.id)
@@ -563,6 +579,29 @@ def errands(errand_id=None):
         if db_session:
             db_session.close()
 
+@app.route('/create_errands_bulk', methods=['POST'])
+def create_errands_bulk():
+    """Create many errands from a JSON array in a single batched insert"""
+    try:
+        user = get_current_user()
+        if not user:
+            return jsonify({'error': 'User not authenticated'}), 401
+
+        records = request.get_json(silent=True)
+        if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+            return jsonify({'error': 'Request body must be a JSON array of errands'}), 400
+
+        created = errand_service.create_errands_bulk(user.id, records)
+        logger.info(f"Bulk created {created} errands for user {user.id}")
+        return jsonify({'message': f'{created} errands created successfully', 'created': created})
+
+    except ValueError as e:
+        logger.warning(f"Validation error creating errands in bulk: {str(e)}")
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error creating errands in bulk: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/calendar')
 def calendar():
     db_session = None
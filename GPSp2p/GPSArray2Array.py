@@ -1,44 +1,212 @@
 #This function will take in 2 arrays of GPS points and output an array the size of the larger of the two
 #containing 1D index for the closest point of the input array
+import threading
 import numpy as np
 
-def arr2arr_match(arr1, arr2, rad=0):
-  assert arr1.dtype == float, "arr1 must not contain non-numeric values like None or Strings"
-  assert arr2.dtype == float, "arr2 must not contain non-numeric values like None or Strings"
-  assert not np.any(np.isnan(arr1)), "arr1 must not contain NaN values."
-  assert not np.any(np.isnan(arr2)), "arr2 must not contain NaN values."
+try:
+  from numba import njit, prange
+except ImportError:  # numba is optional, fall back to the numpy broadcast below
+  njit = None
+
+if njit is not None:
+  @njit(parallel=True, fastmath=True, cache=True, boundscheck=False, error_model='numpy')
+  def _match_kernel(lat1, lon1, lat2, lon2, cos_lat2, order, half):
+    # fused haversine + argmin, one row of arr1 at a time so only O(M) memory is used
+    # haversine distance is monotone in a, so compare on a and skip the arctan2/sqrt
+    # lat2/lon2/cos_lat2 come sorted by latitude (order maps back to arr2 indices). Since
+    # a >= sin(dlat/2)^2, each row scans outward from its own latitude and stops in a
+    # direction once the latitude gap alone rules out beating the best match so far
+    # half is 0.5 in the input dtype so float32 input stays on the float32 sinf path
+    M = lat1.shape[0]
+    N = lat2.shape[0]
+    out = np.empty(M, dtype=np.int64)
+    for i in prange(M):
+      lat1_i = lat1[i]
+      lon1_i = lon1[i]
+      cos_lat1 = np.cos(lat1_i)
+      start = np.searchsorted(lat2, lat1_i)
+      best_a = np.inf
+      best_j = N
+      for step in (1, -1):
+        j = start if step == 1 else start - 1
+        while 0 <= j < N:
+          s_lat = np.sin((lat2[j] - lat1_i) * half)
+          a = s_lat * s_lat
+          if a > best_a:
+            break
+          s_lon = np.sin((lon2[j] - lon1_i) * half)
+          a += cos_lat1 * cos_lat2[j] * s_lon * s_lon
+          # ties go to the lowest arr2 index, same as np.argmin
+          if a < best_a or (a == best_a and order[j] < best_j):
+            best_a = a
+            best_j = order[j]
+          j += step
+      out[i] = best_j
+    return out
+
+try:
+  import numexpr as ne
+except ImportError:  # numexpr is optional, the blocked fallback then uses plain ufuncs
+  ne = None
+
+try:
+  import cupy as cp
+except ImportError:  # cupy is optional, only needed for backend='cupy'
+  cp = None
+
+try:
+  from sklearn.metrics.pairwise import haversine_distances
+  from sklearn.neighbors import BallTree
+except ImportError:  # scikit-learn is optional, arr2arr_dist/arr2arr_match fall back to numpy
+  haversine_distances = None
+  BallTree = None
+
+R = 6371000  # Earth radius in meters
+ROW_BLOCK = 16     # arr1 points per tile
+COL_BLOCK = 8192   # arr2 points per tile, 16 x 8192 doubles = 1 MB scratch (half that for float32)
+HAVERSINE_EXPR = "sin(hlat2_b - hlat1_b)**2 + cos_lat1_b * cos_lat2_b * sin(hlon2_b - hlon1_b)**2"
+BALLTREE_MIN_PAIRS = 1000000  # above this many M x N pairs a BallTree beats brute force
+GPU_BLOCK = 1 << 26  # elements per M x N tile on the GPU, 256 MB of float32
+
+_scratch = threading.local()  # per-thread tile buffers, reused across arr2arr_match calls
+
+def _get_scratch(name, size, dtype):
+  #flat buffer of at least size elements, only reallocated when a bigger one or another dtype is needed
+  buf = getattr(_scratch, name, None)
+  if buf is None or buf.size < size or buf.dtype != dtype:
+    buf = np.empty(size, dtype=dtype)
+    setattr(_scratch, name, buf)
+  return buf
+
+def to_rad(arr):
+  #degrees to radians as one constant multiply in the array's own float dtype (float32 stays float32);
+  #integer degrees are promoted to a float dtype, since pi/180 in an integer dtype would truncate to 0
+  #convert a reference array once and pass rad=1 when it is matched against repeatedly
+  return np.multiply(arr, np.result_type(arr, np.float32).type(np.pi / 180))
+
+def _prep(arr1, arr2, rad, validate, dtype=None):
   assert isinstance(arr1, np.ndarray), "arr1 Array must be np array"
-  assert arr1.size > 0, "arr1 array must not be empty"
   assert isinstance(arr2, np.ndarray), "arr2 Array must be np array"
+  assert np.issubdtype(arr1.dtype, np.floating), "arr1 must not contain non-numeric values like None or Strings"
+  assert np.issubdtype(arr2.dtype, np.floating), "arr2 must not contain non-numeric values like None or Strings"
+  assert arr1.size > 0, "arr1 array must not be empty"
   assert arr2.size > 0, "arr2 array must not be empty"
   assert arr1.ndim == 2 and arr1.shape[1] == 2, "arr1 array must be Nx2."
   assert arr2.ndim == 2 and arr2.shape[1] == 2, "arr2 array must be Mx2."
 
+  if dtype is not None: #cast before the radians conversion so that is done in dtype too
+      arr1 = arr1.astype(dtype, copy=False)
+      arr2 = arr2.astype(dtype, copy=False)
+  #split into separate contiguous lat/lon arrays (SoA) so the trig passes stream through memory,
+  #dtype is kept so float32 input stays float32
   if not rad: #make radian for trig
-      arr1 = np.radians(arr1)
-      arr2 = np.radians(arr2)
-  #parse for easy reference
-  lat1, lon1 = arr1[:,0], arr1[:, 1]
-  lat2, lon2 = arr2[:,0], arr2[:, 1]
-  
-  # Latitude and longitude range validity check
-  assert np.all((-np.pi/2 <= lat1) & (lat1 <= np.pi/2)), "1 or more latitudes in arr1 are invalid."
-  assert np.all((-np.pi/2 <= lat2) & (lat2 <= np.pi/2)), "1 or more latitudes in arr2 are invalid."
-  assert np.all((-np.pi <= lon1) & (lon1 <= np.pi)), "1 or more longitudes in arr1 are invalid."
-  assert np.all((-np.pi <= lon2) & (lon2 <= np.pi)), "1 or more longitudes in arr2 are invalid."
-  #reshape for array opperations
-  lat1 = lat1[:, np.newaxis]  # Shape (M, 1)
-  lon1 = lon1[:, np.newaxis]  # Shape (M, 1)
-  dlat = lat2[np.newaxis,:] - lat1  #should be  MxN 
-  dlon = lon2[np.newaxis,:] - lon1  #should be same MxN 
-  # haversine formula
-  a = np.sin(dlat / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2)**2 #should be same MxN
-  c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a)) #should be same MxN as refarray
-  R = 6371000  # Earth radius in meters
-  dist_arr = R * c
-  min_dist_idxs = np.argmin(dist_arr, axis=1)
-  return min_dist_idxs  
+      lat1, lon1 = to_rad(arr1[:,0]), to_rad(arr1[:, 1])
+      lat2, lon2 = to_rad(arr2[:,0]), to_rad(arr2[:, 1])
+  else:
+      lat1, lon1 = np.ascontiguousarray(arr1[:,0]), np.ascontiguousarray(arr1[:, 1])
+      lat2, lon2 = np.ascontiguousarray(arr2[:,0]), np.ascontiguousarray(arr2[:, 1])
+
+  # NaN and range checks are full passes over both arrays, so they only run when asked for.
+  # import_coordinates_from_csv already validates what it reads and generate_random_gps is in range
+  if validate:
+    assert not np.any(np.isnan(lat1)) and not np.any(np.isnan(lon1)), "arr1 must not contain NaN values."
+    assert not np.any(np.isnan(lat2)) and not np.any(np.isnan(lon2)), "arr2 must not contain NaN values."
+    assert np.all(np.abs(lat1) <= np.pi/2), "1 or more latitudes in arr1 are invalid."
+    assert np.all(np.abs(lat2) <= np.pi/2), "1 or more latitudes in arr2 are invalid."
+    assert np.all(np.abs(lon1) <= np.pi), "1 or more longitudes in arr1 are invalid."
+    assert np.all(np.abs(lon2) <= np.pi), "1 or more longitudes in arr2 are invalid."
+  return lat1, lon1, lat2, lon2
 
+def arr2arr_match(arr1, arr2, rad=0, validate=False, backend=None):
+  #only the ordering of distances matters here, so single precision trig (~1 m) is plenty
+  #backend='cupy' runs the brute force match on a CUDA GPU, worth it for very large arrays
+  lat1, lon1, lat2, lon2 = _prep(arr1, arr2, rad, validate, np.float32)
+  if backend == 'cupy':
+    if cp is None:
+      raise ImportError("backend='cupy' needs cupy installed")
+    return _match_cupy(lat1, lon1, lat2, lon2)
+  assert backend is None, f"unknown backend: {backend}"
+  if BallTree is not None and lat1.shape[0] * lat2.shape[0] >= BALLTREE_MIN_PAIRS:
+    # O(N log N) build on arr2 then O(log N) per arr1 point instead of O(M*N)
+    tree = BallTree(np.column_stack((lat2, lon2)), metric='haversine')
+    _, idx = tree.query(np.column_stack((lat1, lon1)), k=1)
+    return idx[:, 0]
+  if njit is not None:
+    order = np.argsort(lat2, kind='stable')
+    lat2_s = lat2[order]
+    return _match_kernel(lat1, lon1, lat2_s, lon2[order], np.cos(lat2_s), order, lat2.dtype.type(0.5))
+  return _match_blocked(lat1, lon1, lat2, lon2)
 
+def _match_blocked(lat1, lon1, lat2, lon2):
+  # numpy fallback, tiled so the scratch buffers stay cache resident instead of
+  # materializing M x N temporaries. argmin of a == argmin of distance, so no arctan2
+  M, N = lat1.shape[0], lat2.shape[0]
+  rows, cols = min(M, ROW_BLOCK), min(N, COL_BLOCK)
+  dtype = np.result_type(lat1, lat2)
+  # flat buffers so every (m, n) tile view, including the ragged last one, is contiguous
+  a_buf = _get_scratch('a', rows * cols, dtype)
+  t_buf = _get_scratch('t', rows * cols, dtype)
+  best_a = np.full(M, np.inf, dtype=dtype)
+  best_idx = np.zeros(M, dtype=np.int64)
+  cos_lat1 = np.cos(lat1)
+  cos_lat2 = np.cos(lat2)
+  # halve the 1D inputs up front, (lat2 - lat1)/2 == lat2/2 - lat1/2, so the M x N tiles
+  # go straight from the subtraction into sin without a separate scaling pass
+  hlat1, hlon1, hlat2, hlon2 = lat1 * 0.5, lon1 * 0.5, lat2 * 0.5, lon2 * 0.5
+  for ib in range(0, M, rows):
+    hlat1_b = hlat1[ib:ib+rows, np.newaxis]  # Shape (m, 1)
+    hlon1_b = hlon1[ib:ib+rows, np.newaxis]
+    cos_lat1_b = cos_lat1[ib:ib+rows, np.newaxis]
+    m = hlat1_b.shape[0]
+    for jb in range(0, N, cols):
+      hlat2_b = hlat2[jb:jb+cols]
+      n = hlat2_b.shape[0]
+      a = a_buf[:m*n].reshape(m, n)
+      # haversine formula: a = sin(dlat/2)^2 + cos(lat1)cos(lat2)sin(dlon/2)^2
+      if ne is not None:
+        # one fused, multithreaded pass over the tile instead of ~10 ufunc passes
+        ne.evaluate(HAVERSINE_EXPR, out=a, casting='same_kind', local_dict={
+          'hlat1_b': hlat1_b, 'hlon1_b': hlon1_b, 'cos_lat1_b': cos_lat1_b,
+          'hlat2_b': hlat2_b, 'hlon2_b': hlon2[jb:jb+cols], 'cos_lat2_b': cos_lat2[jb:jb+cols]})
+      else:
+        t = t_buf[:m*n].reshape(m, n)
+        np.subtract(hlat2_b, hlat1_b, out=a)
+        np.sin(a, out=a)
+        np.square(a, out=a)
+        np.subtract(hlon2[jb:jb+cols], hlon1_b, out=t)
+        np.sin(t, out=t)
+        np.square(t, out=t)
+        t *= cos_lat1_b
+        t *= cos_lat2[jb:jb+cols]
+        a += t
+      idx = np.argmin(a, axis=1)
+      block_a = np.take_along_axis(a, idx[:, np.newaxis], axis=1)[:, 0]
+      better = block_a < best_a[ib:ib+m]
+      best_a[ib:ib+m][better] = block_a[better]
+      best_idx[ib:ib+m][better] = idx[better] + jb
+  return best_idx
 
+def _match_cupy(lat1, lon1, lat2, lon2):
+  # same broadcast haversine as the numpy path, run on the GPU in tiles of rows that fit GPU_BLOCK
+  M, N = lat1.shape[0], lat2.shape[0]
+  rows = max(1, GPU_BLOCK // N)
+  lat2_d, lon2_d = cp.asarray(lat2), cp.asarray(lon2)
+  cos_lat2_d = cp.cos(lat2_d)
+  hlat2_d, hlon2_d = lat2_d * 0.5, lon2_d * 0.5  # halved once, see _match_blocked
+  out = cp.empty(M, dtype=cp.int64)
+  for ib in range(0, M, rows):
+    lat1_b = cp.asarray(lat1[ib:ib+rows, np.newaxis])  # Shape (m, 1)
+    lon1_b = cp.asarray(lon1[ib:ib+rows, np.newaxis])
+    a = cp.sin(hlat2_d - lat1_b * 0.5)**2 + cp.cos(lat1_b) * cos_lat2_d * cp.sin(hlon2_d - lon1_b * 0.5)**2
+    out[ib:ib+rows] = cp.argmin(a, axis=1)
+  return out.get()
 
+def arr2arr_dist(arr1, arr2, rad=0, validate=False):
+  #full MxN matrix of distances in meters, use arr2arr_match if only the closest index is needed
+  lat1, lon1, lat2, lon2 = _prep(arr1, arr2, rad, validate)
+  if haversine_distances is not None:  # compiled pairwise kernel
+    return R * haversine_distances(np.column_stack((lat1, lon1)), np.column_stack((lat2, lon2)))
+  lat1 = lat1[:, np.newaxis]  # Shape (M, 1)
+  lon1 = lon1[:, np.newaxis]  # Shape (M, 1)
+  a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2 #should be MxN
+  return R * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
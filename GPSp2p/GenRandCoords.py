@@ -1,6 +1,7 @@
 import numpy as np
 
-def generate_random_gps(n):
-    latitudes = np.random.uniform(-90, 90, n)
-    longitudes = np.random.uniform(-180, 180, n)
+def generate_random_gps(n, dtype=np.float32):
+    # float32 keeps ~7 significant digits, about 1 m at the equator, which is enough for GPS
+    latitudes = np.random.uniform(-90, 90, n).astype(dtype)
+    longitudes = np.random.uniform(-180, 180, n).astype(dtype)
     return np.column_stack((latitudes, longitudes))  # Shape (n, 2)
@@ -2,6 +2,28 @@ import csv
 import re
 import numpy as np
 
+# words and symbols to strip out of a coordinate string, compiled once at import
+# longer words come first so e.g. "minutes" is not consumed as "minute" + "s"
+_CLEAN_RE = re.compile(r"minutes|Minutes|minute|Minute|seconds|Seconds|second|Second"
+                       r"|Degrees|degrees|Degree|degree|°|'|\""
+                       r"|North|north|South|south|East|east|West|west")
+_DIRECTIONS = {'north': 'N', 'south': 'S', 'east': 'E', 'west': 'W'}
+
+def _clean_word(match):
+    # direction words become their letter, everything else becomes a space
+    return _DIRECTIONS.get(match.group(0).lower(), ' ')
+
+_DMS_RE = re.compile(r"^(-?\d+(\.\d+)?)(?:\s+(\d+(\.\d+)?))?(?:\s+(\d+(\.\d+)?))?\s+?([NSEWnsew])?$")
+''' 
+    - ^ must start with a match 
+    - -? grab a negative if present
+    - \d+(\.\d+)? grab integer digits and optionally grabs another group for the decimal of the degree input  
+    - (?: not captured and optional group for minutes, minute descimal optional as well 
+    - the same is done for the seconds 
+    - groups 1 3 and 5 also contain 2 4 and 6, IE decimal values are contained in them.
+    - group 7 is NSEW 
+'''
+
 def parse2float(degree_str):
     """
     Convert a latitude/longitude string in various formats to decimal degrees.
@@ -13,43 +35,21 @@ def parse2float(degree_str):
         S and W are negative! 
     - Handles 'degrees' word in place of degree symbol
     """
-    #get rid of extra stupid characters and names etc
-
     degree_str = degree_str.strip()
-    degree_str = degree_str.replace("minutes", " ").replace("seconds", " ")
-    degree_str = degree_str.replace("Minutes", " ").replace("Seconds", " ")
-    degree_str = degree_str.replace("minute", " ").replace("second", " ")
-    degree_str = degree_str.replace("Minute", " ").replace("Second", " ")
-    degree_str = degree_str.replace("'", " ").replace("\"", " ")
-    degree_str = degree_str.replace("North", "N").replace("north", "N")
-    degree_str = degree_str.replace("South", "S").replace("south", "S")
-    degree_str = degree_str.replace("East", "E").replace("east", "E")
-    degree_str = degree_str.replace("West", "W").replace("west", "W")
-    degree_str = degree_str.replace("Degrees", " ").replace("degrees", " ").replace("°", " ").replace("Degree", " ").replace("degree", " ")
-    degree_str = re.sub(r'(\d+)\s(Degrees|degrees|°|Degree|degree)\s*(\d+)\s*(\d+(\.\d+)?)?', r'\1 \3 \4', degree_str)
-    # the line above is a lot to process BUT I'll break it down
-    ''' 
-        - (\d+) :this defines the first group '\1' as any number of digits
-        - (degrees|°)\s*: this is the second group '\2' has the degree work or symbol if present and ignores any number of spaces following it 
-        - from here you should see the next \d grabs the minutes in group 3, ignores spaces or minute sympbol 
-        - and grabs seconds in group 4
-    '''
+    try: # plain decimal degrees are the common case, skip the cleanup entirely
+        return(float(degree_str))
+    except ValueError:
+        pass
+
+    #get rid of extra stupid characters and names etc, all in one pass over the string
+    degree_str = _CLEAN_RE.sub(_clean_word, degree_str)
 
-    match = re.match(r"^(-?\d+(\.\d+)?)(?:\s+(\d+(\.\d+)?))?(?:\s+(\d+(\.\d+)?))?\s+?([NSEWnsew])?$", degree_str)
-    ''' 
-        - ^ must start with a match 
-        - -? grab a negative if present
-        - \d+(\.\d+)? grab integer digits and optionally grabs another group for the decimal of the degree input  
-        - (?: not captured and optional group for minutes, minute descimal optional as well 
-        - the same is done for the seconds 
-        - groups 1 3 and 5 also contain 2 4 and 6, IE decimal values are contained in them.
-        - group 7 is NSEW 
-    '''
     try:
         return(float(degree_str))
     except: 
         pass
 
+    match = _DMS_RE.match(degree_str)
     if match:
         degrees = float(match.group(1))  # Degrees (including decimal part)
         # If minutes are present, process them
@@ -62,27 +62,30 @@ def parse2float(degree_str):
             number = -number
         return number
 
-def import_coordinates_from_csv(filename):
+def import_coordinates_from_csv(filename, dtype=np.float32):
     """
     Import coordinates from CSV file and convert them to decimal
+    Returned as an Nx2 array of dtype (float32 by default, ~1 m precision)
     """
-    coordinates = []
     with open(filename, mode='r', newline='', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        
-        for row in reader:
-            normalized_row = {k.strip().lower(): v for k, v in row.items()} #ChatGPT told me this work make the collumn keys lower case
-            #reader makes key and value pairs, this ignores case on the key
-            latitude = normalized_row['latitude']
-            longitude = normalized_row['longitude']
-            # Add to list if both lat and long are valid
-            if latitude is not None and longitude is not None:
-                # Convert latitude and longitude to decimal degrees
-                latitude_decimal = parse2float(latitude)
-                longitude_decimal = parse2float(longitude)
-                coordinates.append([latitude_decimal, longitude_decimal])
+        reader = csv.reader(csvfile)
+        # find the columns once from the header, ignoring case and padding
+        header = [k.strip().lower() for k in next(reader)]
+        lat_col, lon_col = header.index('latitude'), header.index('longitude')
+        # skip short rows that are missing lat or long
+        pairs = [(row[lat_col], row[lon_col]) for row in reader if len(row) > max(lat_col, lon_col)]
 
-    return np.array(coordinates)
+    try:
+        # plain decimal degrees (the common case) convert in a single numpy pass
+        coordinates = np.array(pairs, dtype=dtype).reshape(-1, 2)
+    except ValueError:
+        # degrees/minutes/seconds, N/S/E/W etc, fall back to parsing each value
+        coordinates = np.array([[parse2float(lat), parse2float(lon)] for lat, lon in pairs], dtype=dtype).reshape(-1, 2)
+    # validate once here so arr2arr_match does not have to on every call
+    assert not np.any(np.isnan(coordinates)), f"{filename} has coordinates that could not be parsed."
+    assert np.all(np.abs(coordinates[:, 0]) <= 90), f"{filename} has 1 or more invalid latitudes."
+    assert np.all(np.abs(coordinates[:, 1]) <= 180), f"{filename} has 1 or more invalid longitudes."
+    return coordinates
 
 
 
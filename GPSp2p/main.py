@@ -12,10 +12,14 @@ TA_FP = "five_airports.csv"  #Target Array
 TA = import_coordinates_from_csv(BP+'/'+ TA_FP)
 #TA = generate_random_gps(10)
 #RA = generate_random_gps(1000000)
+#MA = arr2arr_match(RA, TA, backend='cupy')  # run on a CUDA GPU if cupy is installed
 #lp = LP()
 #lp.add_function(arr2arr_match)
 #lp.enable()
-MA = arr2arr_match(RA,TA)
+# convert to radians once up front, the match then skips its own conversion
+RA_rad = to_rad(RA)
+TA_rad = to_rad(TA)
+MA = arr2arr_match(RA_rad, TA_rad, rad=1)
 print(MA)
 #lp.disable()
 #lp.print_stats()
@@ -29,7 +29,7 @@ def fail_test1():
   BangorME = (44.8012, -68.7778)
   arr1 = np.array([BostonMA, RumneyNH, CapeCodMA])
   arr2 = np.array([DorchesterMA,CambridgeMA,ArlingtonMA,BangorME,PlymouthNH,QuincyMA, JawsBridgeMA])
-  arr2arr_match(arr1, arr2, 0)
+  arr2arr_match(arr1, arr2, 0, validate=True)
 
 def fail_test2(): 
   BostonMA = (42.3601, -71.0589)
@@ -44,7 +44,7 @@ def fail_test2():
   BangorME = (44.8012, -68.7778)
   arr1 = np.array([BostonMA, RumneyNH, CapeCodMA])
   arr2 = np.array([DorchesterMA,CambridgeMA,ArlingtonMA,BangorME,PlymouthNH,QuincyMA, JawsBridgeMA])
-  arr2arr_match(arr1, arr2, 0)
+  arr2arr_match(arr1, arr2, 0, validate=True)
 
 def fail_test3(): 
   BostonMA = ("42.3601", "-71.0589")
@@ -59,7 +59,7 @@ def fail_test3():
   BangorME = (44.8012, -68.7778)
   arr1 = np.array([BostonMA, RumneyNH, CapeCodMA])
   arr2 = np.array([DorchesterMA,CambridgeMA,ArlingtonMA,BangorME,PlymouthNH,QuincyMA, JawsBridgeMA])
-  arr2arr_match(arr1, arr2, 0)
+  arr2arr_match(arr1, arr2, 0, validate=True)
 
 def testgps2arr():
   correct_test()
@@ -5,6 +5,28 @@ import datetime
 from readCSV import *
 import openai
 import re
+import hashlib
+import time
+
+# Markdown ```sql ... ``` fence the model sometimes wraps its query in
+SQL_FENCE = re.compile(r"```sql(.*?)```", re.DOTALL)
+
+LLM_CACHE_TTL = 1800  # seconds a cached AI answer stays valid
+
+SYSTEM_PREFIX = (
+    "You are a helpful AI that generates SQL queries.\n"
+    "You are an AI assistant tasked with converting user queries into SQL statements.\n"
+    "The database uses SQLite and its tables are described in the schema message.\n"
+    "\n"
+    "Your task is to:\n"
+    "1. Generate a SQL query that accurately answers the user's question.\n"
+    "2. Ensure the SQL is compatible with SQLite syntax.\n"
+    "3. Provide a short comment explaining what the query does.\n"
+    "\n"
+    "Output Format:\n"
+    "- SQL Query\n"
+    "- Explanation\n"
+)
 
 def log_error(message):
     """Log error message with timestamp to an error log file."""
@@ -13,57 +35,111 @@ def log_error(message):
     with open(log_file, 'a') as f:
         f.write(f"[{timestamp}] {message}\n")
 
+# Columns of every user table in one pass, joined against the pragma_table_info table-valued function
+SCHEMA_QUERY = (
+    "SELECT m.name, p.name, p.type FROM (" + USER_TABLES_QUERY.rstrip(";") + ") AS m "
+    "JOIN pragma_table_info(m.name) AS p ORDER BY m.name, p.cid;"
+)
+
+# db_path -> (file modification stamp, schema text) so menu cycles skip the introspection queries
+_schema_cache = {}
+
+def db_stamp(db_path):
+    """Modification times of the database and its WAL file, which receives writes until a checkpoint."""
+    wal_path = db_path + "-wal"
+    wal_mtime = os.stat(wal_path).st_mtime_ns if os.path.exists(wal_path) else None
+    return os.stat(db_path).st_mtime_ns, wal_mtime
+
 def get_db_schema(db_path):
     """Retrieve the schema of all tables in the SQLite database."""
     if not os.path.exists(db_path):
         return "No database found."
 
-    conn = sqlite3.connect(db_path)
-    cursor = conn.execute("SELECT name FROM sqlite_master WHERE type='table';")
-    tables = [row[0] for row in cursor.fetchall()]
+    stamp = db_stamp(db_path)
+    cached = _schema_cache.get(db_path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    # One query for every table's columns instead of a PRAGMA round trip per table
+    conn = open_db(db_path)
+    rows = conn.execute(SCHEMA_QUERY).fetchall()
 
     schema_info = ""
-    for table in tables:
-        schema_info += f"\nTable: {table}\n"
-        table_schema = conn.execute(f"PRAGMA table_info({table});").fetchall()
-        for column in table_schema:
-            schema_info += f"  - {column[1]} ({column[2]})\n"
-
-    conn.close()
-    return schema_info.strip()
-def ask_ai_for_sql(schema, user_query):
+    current_table = None
+    for table, column, column_type in rows:
+        if table != current_table:
+            schema_info += f"\nTable: {table}\n"
+            current_table = table
+        schema_info += f"  - {column} ({column_type})\n"
+
+    close_db(conn)
+    schema_info = schema_info.strip()
+    _schema_cache[db_path] = (db_stamp(db_path), schema_info)
+    return schema_info
+def llm_cache_key(schema, user_query):
+    """Key a cached AI answer on the exact schema and question that produced it."""
+    return hashlib.sha256((schema + "\x1f" + user_query).encode()).hexdigest()
+
+def get_cached_sql(db_path, key):
+    """Return a cached (sql, explanation) pair that is younger than LLM_CACHE_TTL, or None."""
+    if not os.path.exists(db_path):
+        return None
+
+    conn = open_db(db_path)
+    try:
+        conn.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, sql TEXT, explanation TEXT, ts INTEGER);")
+        row = conn.execute("SELECT sql, explanation FROM llm_cache WHERE key = ? AND ts > ?;",
+                           (key, int(time.time()) - LLM_CACHE_TTL)).fetchone()
+    finally:
+        close_db(conn)
+    return row
+
+def store_cached_sql(db_path, key, sql_query, explanation):
+    """Save an AI answer and drop any entries that have expired."""
+    # Connecting would create the database file, and a missing database must stay missing
+    if not os.path.exists(db_path):
+        return
+
+    conn = open_db(db_path)
+    try:
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, sql TEXT, explanation TEXT, ts INTEGER);")
+            now = int(time.time())
+            conn.execute("INSERT OR REPLACE INTO llm_cache (key, sql, explanation, ts) VALUES (?, ?, ?, ?);",
+                         (key, sql_query, explanation, now))
+            conn.execute("DELETE FROM llm_cache WHERE ts <= ?;", (now - LLM_CACHE_TTL,))
+    finally:
+        close_db(conn)
+
+def ask_ai_for_sql(schema, user_query, db_path="my_database.db"):
     """Pass table schema and user query to AI, then return the generated SQL and explanation."""
-    
+    # The schema is part of the key, so answers for an older schema are never reused
+    key = llm_cache_key(schema, user_query)
+    cached = get_cached_sql(db_path, key)
+    if cached is not None:
+        return cached[0], cached[1]
+
     openai.api_key =os.getenv("OPENAI_API_KEY")
 
     if not openai.api_key:
         return None, "Error: OpenAI API key is not set or is invalid."
 
-    prompt = f"""
-    You are an AI assistant tasked with converting user queries into SQL statements.
-    The database uses SQLite and contains the following tables:
-    {schema}
-    User Query: {user_query}
-
-    Your task is to:
-    1. Generate a SQL query that accurately answers the user's question.
-    2. Ensure the SQL is compatible with SQLite syntax.
-    3. Provide a short comment explaining what the query does.
-
-    Output Format:
-    - SQL Query
-    - Explanation
-    """
+    # Static text first and the user query last so every call shares the same
+    # byte-identical prefix, which lets OpenAI serve it from its prompt cache.
+    schema_block = "Schema:\n" + "\n".join(line.rstrip() for line in schema.strip().splitlines()) + "\n"
+    cache_key = hashlib.sha256(schema_block.encode()).hexdigest()
 
     try:
         client = openai.OpenAI()  # Create an OpenAI client
         response = client.chat.completions.create(
             model="gpt-4",  # Use "gpt-3.5-turbo" if needed
             messages=[
-                {"role": "system", "content": "You are a helpful AI that generates SQL queries."},
-                {"role": "user", "content": prompt}
+                {"role": "system", "content": SYSTEM_PREFIX},
+                {"role": "system", "content": schema_block},
+                {"role": "user", "content": f"User Query: {user_query}"}
             ],
-            temperature=0
+            temperature=0,
+            prompt_cache_key=cache_key
         )
         ai_output = response.choices[0].message.content.strip()
 
@@ -73,19 +149,22 @@ def ask_ai_for_sql(schema, user_query):
         # Look for SQL Query and Explanation sections
         try:
             # Attempt to find and separate the query and explanation
-            if "SQL Query:" in ai_output and "Explanation:" in ai_output:
+            sql_label = ai_output.find("SQL Query:")
+            explanation_label = ai_output.find("Explanation:")
+            if sql_label != -1 and explanation_label != -1:
                 # Split based on these labels
-                sql_start = ai_output.find("SQL Query:") + len("SQL Query:")
-                sql_stop =  ai_output.find("Explanation:") 
-                explanation_start = ai_output.find("Explanation:") + len("Explanation:")
+                sql_start = sql_label + len("SQL Query:")
+                explanation_start = explanation_label + len("Explanation:")
 
-                sql_query = ai_output[sql_start:sql_stop].strip()
-                sql_query = re.sub(r"```sql(.*?)```", r"\1", sql_query, flags=re.DOTALL).strip()
+                sql_query = ai_output[sql_start:explanation_label].strip()
+                sql_query = SQL_FENCE.sub(r"\1", sql_query).strip()
 
                 explanation = ai_output[explanation_start:].strip()
 
                 # Remove any Markdown code block formatting (```sql ... ```)
-                return sql_query.strip(), explanation.strip()
+                sql_query, explanation = sql_query.strip(), explanation.strip()
+                store_cached_sql(db_path, key, sql_query, explanation)
+                return sql_query, explanation
             else:
                 # If the format is not as expected, return an error message
                 return None, f"Error: The response format was incorrect. AI returned: {ai_output}"
@@ -106,7 +185,7 @@ def run_sql_query(db_path, generated_sql):
     print(schema)
     print(generated_sql + '\n')
     # Execute the SQL query and display results
-    conn = sqlite3.connect(db_path)
+    conn = open_db(db_path)
     try:
         result = pd.read_sql(generated_sql, conn)
         print("\nQuery Result:")
@@ -114,7 +193,7 @@ def run_sql_query(db_path, generated_sql):
     except Exception as e:
         log_error(f"Error running AI-generated query: {str(e)}")
         print(f"Error executing query: {e}")
-    conn.close()
+    close_db(conn)
 
 def chatbot_interaction():
     """Chatbot-like interaction to handle CSV loading, SQL execution, and AI-generated queries."""
@@ -140,6 +219,7 @@ def chatbot_interaction():
             csv_path = input("Enter the path to the CSV file: ").strip()
             if os.path.exists(csv_path):
                 create_or_append_table_from_csv(csv_path, db_path)
+                _schema_cache.pop(db_path, None)
             else:
                 print("File not found. Please enter a valid CSV file path.")
 
@@ -151,7 +231,7 @@ def chatbot_interaction():
             user_query = input("Describe the data you want to retrieve: ").strip()
             schema = get_db_schema(db_path)
 
-            generated_sql, explanation = ask_ai_for_sql(schema, user_query)
+            generated_sql, explanation = ask_ai_for_sql(schema, user_query, db_path)
 
             if generated_sql is None:
                 print("AI failed to generate SQL:", explanation)
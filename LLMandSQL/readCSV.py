@@ -2,6 +2,9 @@ import pandas as pd
 import sqlite3
 import os
 import datetime
+import shutil
+import itertools
+import subprocess
 
 def log_error(message):
     """Log error message to an error log file."""
@@ -10,40 +13,124 @@ def log_error(message):
     with open(log_file, 'a') as f:
         f.write(f"[{timestamp}] {message}\n")
 
-def infer_sqlite_type(value):
-    """Infer SQLite data type from a sample value."""
-    try:
-        int(value)
-        return "INTEGER"
-    except ValueError:
-        try:
-            float(value)
-            return "REAL"
-        except ValueError:
-            return "TEXT"
+# Tables the user loaded, leaving out SQLite's own stats tables and the chatbot's AI answer cache
+USER_TABLES_QUERY = "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' AND name != 'llm_cache';"
+
+# Applied to every connection: WAL lets readers run alongside a writer and, with
+# synchronous=NORMAL, avoids an fsync per transaction; the rest keep temp tables,
+# 64 MB of page cache and a 256 MB memory map in RAM
+CONNECTION_PRAGMAS = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-65536;
+PRAGMA mmap_size=268435456;
+"""
+
+def open_db(db_path):
+    """Open a SQLite connection with the tuned PRAGMAs applied."""
+    conn = sqlite3.connect(db_path, cached_statements=512)
+    conn.executescript(CONNECTION_PRAGMAS)
+    return conn
+
+def close_db(conn):
+    """Let SQLite refresh its query planner statistics, then close the connection."""
+    conn.execute("PRAGMA optimize;")
+    conn.close()
+
+# SQLite column type for each numpy dtype kind; anything else (strings, dates) is stored as TEXT
+SQLITE_TYPES = {'i': "INTEGER", 'u': "INTEGER", 'b': "INTEGER", 'f': "REAL"}
+
+# CSVs larger than this are loaded by the sqlite3 shell's C importer instead of through pandas
+LARGE_CSV_BYTES = 100 * 1024 * 1024
+# Rows read from a large CSV to pick its column types and indexes
+SAMPLE_ROWS = 10000
+# Rows pandas reads at a time, so memory stays bounded however long the CSV is
+CSV_CHUNK_ROWS = 50000
 
 def table_exists(conn, table_name):
     """Check if a table exists in the SQLite database."""
-    query = f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}';"
-    cursor = conn.execute(query)
+    cursor = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?;", (table_name,))
     return cursor.fetchone() is not None
 
 def get_table_schema(conn, table_name):
     """Retrieve the schema of an existing SQLite table."""
-    query = f"PRAGMA table_info({table_name});"
-    cursor = conn.execute(query)
-    schema = {row[1]: row[2] for row in cursor.fetchall()}  # {column_name: data_type}
+    cursor = conn.execute("SELECT name, type FROM pragma_table_info(?);", (table_name,))
+    schema = {row[0]: row[1] for row in cursor.fetchall()}  # {column_name: data_type}
     return schema
+
+def create_table(conn, table_name, df):
+    """Create a table whose column types follow the DataFrame dtypes."""
+    # Infer data types from the column dtypes pandas already parsed
+    column_types = {col: SQLITE_TYPES.get(df[col].dtype.kind, "TEXT") for col in df.columns}
+
+    # Generate the CREATE TABLE statement
+    columns = ", ".join([f"{col} {col_type}" for col, col_type in column_types.items()])
+    create_table_query = f"CREATE TABLE IF NOT EXISTS {table_name} ({columns});"
+    conn.execute(create_table_query)
+    conn.commit()
+
+def cli_import_fixup(col, kind):
+    """SQL expression that turns a column imported as text by the shell into what pandas stores."""
+    # The shell imports empty fields as '' where pandas reads them as missing, so make them NULL;
+    # in typed columns '' would otherwise stay TEXT
+    if kind != 'b':
+        return f"NULLIF({col}, '')"
+    # Type affinity cannot cast True/False text, so store 1/0 as pandas does for bool columns
+    return f"CASE lower({col}) WHEN 'true' THEN 1 WHEN 'false' THEN 0 ELSE NULLIF({col}, '') END"
+
+def import_csv_with_cli(conn, csv_path, db_path, table_name, df):
+    """Bulk load a CSV into an existing table with the sqlite3 command line shell."""
+    # The table already has typed columns, so SQLite's type affinity converts the imported text
+    subprocess.run(["sqlite3", db_path, f'.import --csv --skip 1 "{csv_path}" {table_name}'], check=True)
+
+    # Make the imported values match a table loaded through pandas from the same CSV
+    assignments = ", ".join(f"{col} = {cli_import_fixup(col, df[col].dtype.kind)}" for col in df.columns)
+    with conn:
+        conn.execute(f"UPDATE {table_name} SET {assignments};")
+
+def insert_csv(conn, table_name, first_chunk, chunks):
+    """Insert a CSV's rows one chunk at a time and return how many there were."""
+    row_count = 0
+    for chunk in itertools.chain([first_chunk], chunks):
+        insert_rows(conn, table_name, chunk)
+        row_count += len(chunk)
+    return row_count
+
+def insert_query(table_name, columns):
+    """Parameterized INSERT of one row into the given columns."""
+    placeholders = ", ".join("?" * len(columns))
+    return f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders});"
+
+def insert_rows(conn, table_name, df):
+    """Insert every DataFrame row with one parameterized statement in a single transaction."""
+    with conn:  # commits once at the end, or rolls back if any row fails
+        conn.executemany(insert_query(table_name, df.columns), df.itertuples(index=False, name=None))
+
+def create_indexes(conn, table_name, df):
+    """Index numeric and high-cardinality columns so filters on them avoid full table scans."""
+    with conn:
+        for col in df.columns:
+            values = df[col].dropna()
+            if values.empty:
+                continue
+            numeric = pd.api.types.is_numeric_dtype(values)
+            # long free-text columns make big indexes that AI generated filters rarely hit
+            if not numeric and values.astype(str).str.len().mean() > 64:
+                continue
+            if numeric or values.nunique() / len(df) > 0.1:
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_{col} ON {table_name} ({col});")
+
 def list_tables(db_path):
     """Lists all tables in the SQLite database."""
     if not os.path.exists(db_path):
         print("No database found. Load a CSV first.")
         return
 
-    conn = sqlite3.connect(db_path)
-    cursor = conn.execute("SELECT name FROM sqlite_master WHERE type='table';")
+    conn = open_db(db_path)
+    cursor = conn.execute(USER_TABLES_QUERY)
     tables = [row[0] for row in cursor.fetchall()]
-    conn.close()
+    close_db(conn)
 
     if tables:
         print("\nTables in the database:")
@@ -71,9 +158,18 @@ def schema_matches(conn, table_name, df):
 
     return True
 
-def append_unique_data(conn, table_name, new_data):
-    """Append only new data to an existing SQLite table, ensuring schema match."""
-    # Check for schema match
+def write_chunks(conn, table_name, chunks, if_exists):
+    """Write every DataFrame chunk to a table, replacing or appending to it for the first one."""
+    for chunk in chunks:
+        chunk.to_sql(table_name, conn, if_exists=if_exists, index=False)
+        if_exists = 'append'
+
+def append_unique_data(conn, table_name, chunks):
+    """Append only new data from an iterator of CSV chunks to an existing SQLite table, ensuring schema match."""
+    new_data = next(chunks)
+    chunks = itertools.chain([new_data], chunks)
+
+    # Check for schema match on the first chunk
     if not schema_matches(conn, table_name, new_data):
         error_message = f"Schema mismatch between CSV and existing table '{table_name}'."
         print(error_message)
@@ -85,12 +181,12 @@ def append_unique_data(conn, table_name, new_data):
             if choice == 'o':
                 # Drop the existing table and recreate it
                 conn.execute(f"DROP TABLE IF EXISTS {table_name};")
-                new_data.to_sql(table_name, conn, if_exists='replace', index=False)
+                write_chunks(conn, table_name, chunks, 'replace')
                 print(f"Table '{table_name}' has been overwritten with new data.")
                 return
             elif choice == 'r':
                 new_table_name = input("Enter a new table name: ").strip()
-                new_data.to_sql(new_table_name, conn, if_exists='replace', index=False)
+                write_chunks(conn, new_table_name, chunks, 'replace')
                 print(f"Data saved to new table '{new_table_name}'.")
                 return
             elif choice == 's':
@@ -99,22 +195,27 @@ def append_unique_data(conn, table_name, new_data):
             else:
                 print("Invalid choice. Please enter 'O', 'R', or 'S'.")
 
-    # Load existing data from the database
-    existing_data = pd.read_sql(f"SELECT * FROM {table_name};", conn)
-
-    # Find new rows that are not in the existing data
-    combined = pd.concat([existing_data, new_data]).drop_duplicates(keep=False)
-    unique_new_data = combined[~combined.isin(existing_data)].dropna(how="all")
-
-    if not unique_new_data.empty:
-        # Build and execute INSERT statements using string formatting
-        columns = ", ".join(unique_new_data.columns)
-        for _, row in unique_new_data.iterrows():
-            values = ", ".join(f"'{str(val)}'" if isinstance(val, str) else str(val) for val in row)
-            insert_query = f"INSERT INTO {table_name} ({columns}) VALUES ({values});"
-            conn.execute(insert_query)
-        conn.commit()
-        print(f"Appended {len(unique_new_data)} new rows to '{table_name}'.")
+    # Stage the CSV rows and let SQLite find the ones not already in the table
+    staging_table = f"__staging_{table_name}"
+    columns = ", ".join(new_data.columns)
+    conn.execute(f"DROP TABLE IF EXISTS {staging_table};")
+    conn.execute(f"CREATE TABLE {staging_table} AS SELECT {columns} FROM {table_name} WHERE 0;")
+    staging_insert = insert_query(staging_table, new_data.columns)
+    try:
+        # One transaction for staging every chunk and inserting the new rows; to_sql would commit
+        # after each chunk, so the rows go through executemany and a failure rolls all of it back
+        with conn:
+            for chunk in chunks:
+                conn.executemany(staging_insert, chunk.itertuples(index=False, name=None))
+            cursor = conn.execute(
+                f"INSERT INTO {table_name} ({columns}) "
+                f"SELECT {columns} FROM {staging_table} EXCEPT SELECT {columns} FROM {table_name};"
+            )
+    finally:
+        conn.execute(f"DROP TABLE IF EXISTS {staging_table};")
+
+    if cursor.rowcount > 0:
+        print(f"Appended {cursor.rowcount} new rows to '{table_name}'.")
     else:
         print("No new data to append.")
 
@@ -124,39 +225,48 @@ def create_or_append_table_from_csv(csv_path, db_path, table_name = None):
     if table_name is None:
         table_name = os.path.splitext(os.path.basename(csv_path))[0]
 
-    # Load the CSV into a DataFrame
-    df = pd.read_csv(csv_path)
-
     # Connect to SQLite database
-    conn = sqlite3.connect(db_path)
+    conn = open_db(db_path)
 
     # Check if the table already exists
     if table_exists(conn, table_name):
         print(f"Table '{table_name}' exists. Checking schema and appending unique data...")
-        append_unique_data(conn, table_name, df)
+        append_unique_data(conn, table_name, pd.read_csv(csv_path, chunksize=CSV_CHUNK_ROWS))
+    elif os.path.getsize(csv_path) > LARGE_CSV_BYTES and shutil.which("sqlite3"):
+        print(f"Table '{table_name}' does not exist. Importing large CSV with the sqlite3 shell...")
+
+        # Only a sample goes through pandas, to choose column types and indexes
+        df = pd.read_csv(csv_path, nrows=SAMPLE_ROWS)
+        create_table(conn, table_name, df)
+        try:
+            import_csv_with_cli(conn, csv_path, db_path, table_name, df)
+            row_count = conn.execute(f"SELECT COUNT(*) FROM {table_name};").fetchone()[0]
+        except subprocess.CalledProcessError as e:
+            error_message = f"sqlite3 shell import of '{csv_path}' failed ({e}), loading it with pandas instead"
+            print(error_message)
+            log_error(error_message)
+            # Drop whatever the shell managed to import before it failed
+            with conn:
+                conn.execute(f"DELETE FROM {table_name};")
+            chunks = pd.read_csv(csv_path, chunksize=CSV_CHUNK_ROWS)
+            row_count = insert_csv(conn, table_name, next(chunks), chunks)
+        create_indexes(conn, table_name, df)
+        print(f"Table '{table_name}' created with {row_count} rows.")
     else:
         print(f"Table '{table_name}' does not exist. Creating table...")
-        
-        # Infer data types and generate the CREATE TABLE statement using string formatting
-        column_types = {}
-        for col in df.columns:
-            sample_value = df[col].dropna().iloc[0] if not df[col].dropna().empty else ""
-            column_types[col] = infer_sqlite_type(sample_value)
-
-        # Generate the CREATE TABLE statement
-        columns = ", ".join([f"{col} {col_type}" for col, col_type in column_types.items()])
-        create_table_query = f"CREATE TABLE IF NOT EXISTS {table_name} ({columns});"
-        conn.execute(create_table_query)
-        conn.commit()
-
-        # Insert all data into the new table using string formatting
-        for _, row in df.iterrows():
-            values = ", ".join(f"'{str(val)}'" if isinstance(val, str) else str(val) for val in row)
-            insert_query = f"INSERT INTO {table_name} ({', '.join(df.columns)}) VALUES ({values});"
-            print("Generated SQL Insert Query:", insert_query)
-            conn.execute(insert_query)
-        conn.commit()
-        print(f"Table '{table_name}' created with {len(df)} rows.")
+        chunks = pd.read_csv(csv_path, chunksize=CSV_CHUNK_ROWS)
+
+        # Column types and indexes are chosen from the first chunk
+        df = next(chunks)
+        create_table(conn, table_name, df)
+
+        # Insert all data into the new table one chunk at a time
+        row_count = insert_csv(conn, table_name, df, chunks)
+        create_indexes(conn, table_name, df)
+        print(f"Table '{table_name}' created with {row_count} rows.")
+
+    # Refresh the query planner statistics for the new rows
+    conn.execute("ANALYZE;")
 
     # Verify the data import (showing a few rows)
     sample_query = f"SELECT * FROM {table_name} LIMIT 5;"
@@ -166,5 +276,5 @@ def create_or_append_table_from_csv(csv_path, db_path, table_name = None):
         print(row)
 
     # Close the connection
-    conn.close()
+    close_db(conn)
 
@@ -82,12 +82,11 @@ def append_unique_data(conn, table_name, new_data):
     unique_new_data = combined[~combined.isin(existing_data)].dropna(how="all")
 
     if not unique_new_data.empty:
-        # Build and execute INSERT statements using string formatting
+        # One parameterized INSERT for every row, so quotes in values can't break the query
         columns = ", ".join(unique_new_data.columns)
-        for _, row in unique_new_data.iterrows():
-            values = ", ".join(f"'{str(val)}'" if isinstance(val, str) else str(val) for val in row)
-            insert_query = f"INSERT INTO {table_name} ({columns}) VALUES ({values});"
-            conn.execute(insert_query)
+        placeholders = ", ".join("?" * len(unique_new_data.columns))
+        insert_query = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders});"
+        conn.executemany(insert_query, unique_new_data.itertuples(index=False, name=None))
         conn.commit()
         print(f"Appended {len(unique_new_data)} new rows to '{table_name}'.")
     else:
@@ -123,11 +122,10 @@ def create_or_append_table_from_csv(csv_path, db_path):
         conn.execute(create_table_query)
         conn.commit()
 
-        # Insert all data into the new table using string formatting
-        for _, row in df.iterrows():
-            values = ", ".join(f"'{str(val)}'" if isinstance(val, str) else str(val) for val in row)
-            insert_query = f"INSERT INTO {table_name} ({', '.join(df.columns)}) VALUES ({values});"
-            conn.execute(insert_query)
+        # Insert all data into the new table with one parameterized statement
+        placeholders = ", ".join("?" * len(df.columns))
+        insert_query = f"INSERT INTO {table_name} ({', '.join(df.columns)}) VALUES ({placeholders});"
+        conn.executemany(insert_query, df.itertuples(index=False, name=None))
         conn.commit()
         print(f"Table '{table_name}' created with {len(df)} rows.")
 
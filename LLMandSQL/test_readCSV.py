@@ -0,0 +1,46 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import readCSV
+
+CSV_TEXT = """id,name,active,score
+1,alice,True,1.5
+2,,False,
+3,carol,True,2.25
+"""
+
+class TestCsvImport(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.csv_path = os.path.join(self.tmp_dir, "people.csv")
+        with open(self.csv_path, "w") as f:
+            f.write(CSV_TEXT)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def load(self, db_name, large_csv_bytes):
+        """Load the CSV into a fresh database and return its rows with their SQLite types."""
+        db_path = os.path.join(self.tmp_dir, db_name)
+        with mock.patch.object(readCSV, "LARGE_CSV_BYTES", large_csv_bytes):
+            readCSV.create_or_append_table_from_csv(self.csv_path, db_path)
+        conn = readCSV.open_db(db_path)
+        rows = conn.execute(
+            "SELECT id, typeof(id), name, typeof(name), active, typeof(active), score, typeof(score) "
+            "FROM people ORDER BY id;"
+        ).fetchall()
+        readCSV.close_db(conn)
+        return rows
+
+    @unittest.skipUnless(shutil.which("sqlite3"), "sqlite3 shell not installed")
+    def test_cli_import_matches_pandas(self):
+        pandas_rows = self.load("pandas.db", readCSV.LARGE_CSV_BYTES)
+        cli_rows = self.load("cli.db", 0)
+        self.assertEqual(cli_rows, pandas_rows)
+        self.assertEqual(pandas_rows[1], (2, "integer", None, "null", 0, "integer", None, "null"))
+
+if __name__ == "__main__":
+    unittest.main()
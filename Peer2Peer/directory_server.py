@@ -1,12 +1,16 @@
+import asyncio
 import socket
 import threading
 import json
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Set
 import logging
 import time
 import os
 import signal
+import queue
+import atexit
 import sys
+from framing import encode_frame, read_frame
 
 # Configure logging
 logging.basicConfig(
@@ -15,6 +19,13 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Seconds to wait after a registration before writing the registry, so a burst of
+# registrations costs one file write instead of one per user
+REGISTRY_FLUSH_INTERVAL = 1.0
+
+# Seconds the log writer waits to collect events before writing them in one batch
+LOG_FLUSH_INTERVAL = 0.1
+
 class DirectoryServer:
     def __init__(self, host: str = '0.0.0.0', port: int = 5000):
         self.host = host
@@ -23,8 +34,16 @@ class DirectoryServer:
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.users: Dict[str, dict] = {}  # username -> user_info
         self.ip_to_username: Dict[str, str] = {}  # ip:port -> username
+        self.ip_index: Dict[str, Set[str]] = {}  # ip -> usernames registered from it
+        # Read-only copies of users and the IP index, swapped in whole after each change so queries need no lock
+        self._snapshot = ({}, {})
         self.lock = threading.Lock()  # For thread-safe operations
         self.running = True  # Flag to control server loop
+        # Request handlers by action, so each request is dispatched with one dict lookup
+        self._action_handlers = {
+            'register': lambda request, address: self.register_user(request),
+            'query': self.query_users,
+        }
         
         # Create log directory if it doesn't exist
         script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -37,12 +56,24 @@ class DirectoryServer:
         with open(self.log_file, 'w') as f:
             f.write(f"Directory Server Log - Started at {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
             f.write("=" * 50 + "\n\n")
+
+        # Events are queued and written in batches by a background thread through one open handle
+        self._log_queue = queue.Queue()
+        self._log_fh = open(self.log_file, 'a')
+        self._log_writer = threading.Thread(target=self._log_writer_loop, daemon=True)
+        self._log_writer.start()
+        atexit.register(self._close_log)
             
         # Registry file path
         self.registry_file = os.path.join(script_dir, "directory_registry.json")
         
         # Load existing registry if available
         self._load_registry()
+
+        # Registrations only mark the registry dirty; a background thread writes it out
+        self._registry_dirty = threading.Event()
+        self._registry_flusher = threading.Thread(target=self._flush_registry_loop, daemon=True)
+        self._registry_flusher.start()
         
         # Set up signal handlers
         signal.signal(signal.SIGINT, self._handle_shutdown)
@@ -53,13 +84,24 @@ class DirectoryServer:
         logger.info(f"Received signal {signum}, initiating graceful shutdown...")
         self._log_event("SHUTDOWN", f"Received signal {signum}, initiating graceful shutdown")
         self.running = False
+        # Write out any registrations the flusher has not saved yet
+        if self._registry_dirty.is_set():
+            self._save_registry()
         # Close the server socket to stop accepting new connections
         try:
             self.server_socket.close()
         except:
             pass
+        self._close_log()
         sys.exit(0)
 
+    def _stop_serving(self, signum):
+        """Handle shutdown signals delivered through the event loop"""
+        logger.info(f"Received signal {signum}, initiating graceful shutdown...")
+        self._log_event("SHUTDOWN", f"Received signal {signum}, initiating graceful shutdown")
+        # _serve sees the flag within a second, closes the listener and start() saves the registry
+        self.running = False
+
     def _load_registry(self):
         """Load the registry from JSON file"""
         try:
@@ -68,6 +110,9 @@ class DirectoryServer:
                     registry = json.load(f)
                     self.users = registry.get('users', {})
                     self.ip_to_username = registry.get('ip_to_username', {})
+                for username, user_info in self.users.items():
+                    self._index_user(username, user_info['ip'])
+                self._publish_snapshot()
                 logger.info(f"Loaded registry with {len(self.users)} users")
                 self._log_event("REGISTRY_LOADED", f"Loaded registry with {len(self.users)} users")
             else:
@@ -77,20 +122,53 @@ class DirectoryServer:
             logger.error(f"Error loading registry: {e}")
             self._log_event("REGISTRY_LOAD_ERROR", f"Error loading registry: {e}")
 
+    def _index_user(self, username: str, ip: str):
+        """Add a user to the query indexes"""
+        self.ip_index.setdefault(ip, set()).add(username)
+
+    def _unindex_user(self, username: str, ip: str):
+        """Remove a user's old IP from the query indexes"""
+        usernames = self.ip_index.get(ip)
+        if usernames is not None:
+            usernames.discard(username)
+            if not usernames:
+                del self.ip_index[ip]
+
+    def _publish_snapshot(self):
+        """Replace the query snapshot with copies of the current users and IP index; call with self.lock held"""
+        self._snapshot = (
+            dict(self.users),
+            {ip: frozenset(usernames) for ip, usernames in self.ip_index.items()}
+        )
+
     def _save_registry(self):
         """Save the registry to JSON file"""
         try:
-            with open(self.registry_file, 'w') as f:
-                json.dump({
+            self._registry_dirty.clear()
+            with self.lock:
+                data = json.dumps({
                     'users': self.users,
                     'ip_to_username': self.ip_to_username
-                }, f, indent=2)
+                }, separators=(',', ':'))
+            # Write to a temp file and rename so readers never see a half-written registry
+            tmp_file = self.registry_file + ".tmp"
+            with open(tmp_file, 'w') as f:
+                f.write(data)
+            os.replace(tmp_file, self.registry_file)
             logger.info(f"Saved registry with {len(self.users)} users")
             self._log_event("REGISTRY_SAVED", f"Saved registry with {len(self.users)} users")
         except Exception as e:
             logger.error(f"Error saving registry: {e}")
             self._log_event("REGISTRY_SAVE_ERROR", f"Error saving registry: {e}")
 
+    def _flush_registry_loop(self):
+        """Save the registry shortly after it changes, batching registrations that arrive together"""
+        while self.running:
+            self._registry_dirty.wait()
+            time.sleep(REGISTRY_FLUSH_INTERVAL)
+            if self._registry_dirty.is_set():
+                self._save_registry()
+
     def start(self):
         """Start the directory server"""
         try:
@@ -99,44 +177,67 @@ class DirectoryServer:
             logger.info(f"Directory server started on {self.host}:{self.port}")
             self._log_event("SERVER_START", f"Directory server started on {self.host}:{self.port}")
 
-            while self.running:
-                try:
-                    # Set a timeout on accept so we can check self.running periodically
-                    self.server_socket.settimeout(1.0)
-                    client_socket, address = self.server_socket.accept()
-                    logger.info(f"New connection from {address}")
-                    self._log_event("NEW_CONNECTION", f"New connection from {address}")
-                    client_thread = threading.Thread(
-                        target=self.handle_client,
-                        args=(client_socket, address)
-                    )
-                    client_thread.daemon = True  # Thread will exit when main thread exits
-                    client_thread.start()
-                except socket.timeout:
-                    # Timeout occurred, check if we should continue running
-                    continue
-                except Exception as e:
-                    if self.running:  # Only log errors if we're still supposed to be running
-                        logger.error(f"Error accepting connection: {e}")
-                        self._log_event("ACCEPT_ERROR", f"Error accepting connection: {e}")
+            # One event loop serves every client instead of a thread per connection
+            asyncio.run(self._serve())
         except Exception as e:
             logger.error(f"Server error: {e}")
             self._log_event("SERVER_ERROR", f"Server error: {e}")
         finally:
             self.server_socket.close()
+            if self._registry_dirty.is_set():
+                self._save_registry()
             logger.info("Directory server shut down")
             self._log_event("SERVER_SHUTDOWN", "Directory server shut down")
+            self._close_log()
+
+    async def _serve(self):
+        """Accept clients on the event loop until the server is stopped"""
+        loop = asyncio.get_running_loop()
+        # Signals can only be routed through the loop when it runs in the main thread
+        if threading.current_thread() is threading.main_thread():
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, self._stop_serving, sig)
+
+        server = await asyncio.start_server(self.handle_client, sock=self.server_socket)
+        async with server:
+            while self.running:
+                # Check self.running periodically, like the old accept timeout did
+                await asyncio.sleep(1.0)
 
     def _log_event(self, event_type, message):
         """Log an event to the log file"""
         timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
         log_entry = f"[{timestamp}] {event_type}: {message}\n"
         
-        with open(self.log_file, 'a') as f:
-            f.write(log_entry)
+        self._log_queue.put(log_entry)
             
         logger.info(f"{event_type}: {message}")
 
+    def _log_writer_loop(self):
+        """Write queued log entries in batches until _close_log sends None"""
+        while True:
+            entry = self._log_queue.get()
+            if entry is not None:
+                time.sleep(LOG_FLUSH_INTERVAL)
+            entries = []
+            while entry is not None:
+                entries.append(entry)
+                try:
+                    entry = self._log_queue.get_nowait()
+                except queue.Empty:
+                    break
+            self._log_fh.writelines(entries)
+            self._log_fh.flush()
+            if entry is None:
+                return
+
+    def _close_log(self):
+        """Write out any queued log entries and close the log file"""
+        if self._log_writer.is_alive():
+            self._log_queue.put(None)
+            self._log_writer.join(timeout=5)
+            self._log_fh.close()
+
     def _log_current_users(self):
         """Log detailed information about current users"""
         if not self.users:
@@ -149,36 +250,37 @@ class DirectoryServer:
             
         self._log_event("CURRENT_USERS", f"Current users ({len(self.users)}): {', '.join(user_details)}")
 
-    def handle_client(self, client_socket: socket.socket, address: tuple):
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
         """Handle individual client connections"""
+        # asyncio already sets TCP_NODELAY on its TCP sockets, so small replies go out immediately
+        address = writer.get_extra_info('peername')
+        logger.info(f"New connection from {address}")
+        self._log_event("NEW_CONNECTION", f"New connection from {address}")
         try:
             while True:
-                data = client_socket.recv(1024).decode('utf-8')
-                if not data:
+                request = await read_frame(reader)
+                if request is None:
                     break
 
-                request = json.loads(data)
                 self._log_event("REQUEST_RECEIVED", f"From {address}: {request.get('action', 'unknown')}")
                 response = self.process_request(request, address)
-                client_socket.send(json.dumps(response).encode('utf-8'))
+                writer.write(encode_frame(response))
+                await writer.drain()
                 self._log_event("RESPONSE_SENT", f"To {address}: {response.get('status', 'unknown')}")
         except Exception as e:
             logger.error(f"Error handling client {address}: {e}")
             self._log_event("CLIENT_ERROR", f"Error handling client {address}: {e}")
         finally:
-            client_socket.close()
+            writer.close()
             logger.info(f"Connection closed for {address}")
             self._log_event("CONNECTION_CLOSED", f"Connection closed for {address}")
 
     def process_request(self, request: dict, address: tuple) -> dict:
         """Process incoming requests"""
-        action = request.get('action')
-        if action == 'register':
-            return self.register_user(request)
-        elif action == 'query':
-            return self.query_users(request, address)
-        else:
+        handler = self._action_handlers.get(request.get('action'))
+        if handler is None:
             return {'status': 'error', 'message': 'Invalid action'}
+        return handler(request, address)
 
     def register_user(self, request: dict) -> dict:
         """Register a new user or update existing user"""
@@ -214,6 +316,7 @@ class DirectoryServer:
                     old_ip_port = f"{self.users[username]['ip']}:{self.users[username]['port']}"
                     if old_ip_port in self.ip_to_username:
                         del self.ip_to_username[old_ip_port]
+                    self._unindex_user(username, self.users[username]['ip'])
 
                 # Add new user info
                 self.users[username] = {
@@ -225,9 +328,11 @@ class DirectoryServer:
                 }
                 # Add IP mapping
                 self.ip_to_username[f"{ip}:{port}"] = username
+                self._index_user(username, ip)
+                self._publish_snapshot()
                 
-                # Save registry after update
-                self._save_registry()
+                # Let the flusher thread save the registry
+                self._registry_dirty.set()
 
             # Log user registration
             self._log_event("USER_REGISTERED", f"User {username} registered at {ip}:{port}")
@@ -252,29 +357,26 @@ class DirectoryServer:
             query_type = request.get('query_type', 'all')
             search_term = request.get('search_term', '').lower()
 
-            with self.lock:
-                if query_type == 'all':
-                    users = list(self.users.values())
-                elif query_type == 'name':
-                    users = [
-                        user for username, user in self.users.items()
-                        if search_term in username.lower()
-                    ]
-                elif query_type == 'ip':
-                    users = [
-                        user for user in self.users.values()
-                        if search_term in user['ip']
-                    ]
-                elif query_type == 'search':
-                    users = [
-                        user for username, user in self.users.items()
-                        if search_term in username.lower() or search_term in user['ip']
-                    ]
-                else:
-                    return {
-                        'status': 'error',
-                        'message': 'Invalid query type'
-                    }
+            if query_type not in ('all', 'name', 'ip', 'search'):
+                return {
+                    'status': 'error',
+                    'message': 'Invalid query type'
+                }
+
+            # Read the latest published snapshot; it is never modified, so no lock is needed
+            users_snapshot, ip_snapshot = self._snapshot
+            names = users_snapshot if query_type in ('name', 'search') else ()
+            ips = ip_snapshot.items() if query_type in ('ip', 'search') else ()
+
+            if query_type == 'all':
+                users = list(users_snapshot.values())
+            else:
+                # Match names against every username, and IPs against the distinct registered IPs
+                matched = {username for username in names if search_term in username.lower()}
+                for ip, usernames in ips:
+                    if search_term in ip:
+                        matched.update(u for u in usernames if u in users_snapshot and users_snapshot[u]['ip'] == ip)
+                users = [user for username, user in users_snapshot.items() if username in matched]
 
             # Log the query
             self._log_event("USER_QUERY", f"Query from {username}: {query_type} - {search_term}")
@@ -0,0 +1,223 @@
+import asyncio
+import os
+import socket
+import struct
+import time
+import json
+import re
+from typing import List, Optional, Tuple
+
+# orjson encodes and decodes several times faster than the json module; fall back when it is not installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# msgspec's MessagePack codec is faster again and makes smaller frames. Frames are only sent as
+# MessagePack when PEER_WIRE_FORMAT=msgpack, because every peer then needs msgspec to read them;
+# received frames are read in either format
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+if msgspec is not None:
+    _MSGPACK_ENCODER = msgspec.msgpack.Encoder()
+    _MSGPACK_DECODER = msgspec.msgpack.Decoder()
+
+    class MessageFrame(msgspec.Struct):
+        """The fields of a peer message that the listener reads; any other fields are skipped while decoding"""
+        content: str
+        timestamp: str
+
+    # Typed decoders build a MessageFrame directly instead of a dict of every field
+    _MESSAGE_JSON_DECODER = msgspec.json.Decoder(MessageFrame)
+    _MESSAGE_MSGPACK_DECODER = msgspec.msgpack.Decoder(MessageFrame)
+
+USE_MSGPACK = msgspec is not None and os.environ.get('PEER_WIRE_FORMAT', 'json').lower() == 'msgpack'
+
+# Every JSON message starts with one of these bytes, while a MessagePack map or array never does
+_JSON_START = frozenset(b'{[ \t\r\n')
+
+# Without orjson, reuse one encoder and decoder; compact separators also keep frames smaller
+_JSON_ENCODER = json.JSONEncoder(separators=(',', ':'))
+_JSON_DECODER = json.JSONDecoder()
+
+# Matches only an "action" key that opens the top-level object, as every message this package sends does;
+# anywhere else it could belong to a nested object. MessagePack strings are raw bytes, so it is never used on them
+_ACTION_FIELD = re.compile(rb'\s*\{\s*"action"\s*:\s*"([^"\\]*)"')
+
+# Every message on the wire is a 4-byte big-endian length followed by that many
+# bytes of UTF-8 JSON (or MessagePack), so a reader always knows where one message ends and the next begins
+HEADER = struct.Struct(">I")
+
+# Largest frame body a reader accepts. A bigger length is garbage or an unframed sender, and
+# trusting it would have the reader allocate up to 4 GiB, so the connection is dropped instead
+MAX_FRAME_SIZE = 4 * 1024 * 1024
+
+# MSG_WAITALL lets the kernel fill the whole buffer in one call where it is supported
+_RECV_FLAGS = getattr(socket, 'MSG_WAITALL', 0)
+
+# Payloads larger than this are sent with sendmsg rather than copied onto their header
+SENDMSG_THRESHOLD = 16 * 1024
+
+# Last second formatted by _now_str and its text
+_TS_CACHE = [0, '']
+
+def _now_str() -> str:
+    """Current local time as 'YYYY-MM-DD HH:MM:SS', formatted at most once per second"""
+    t = int(time.time())
+    if t != _TS_CACHE[0]:
+        _TS_CACHE[0] = t
+        _TS_CACHE[1] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t))
+    return _TS_CACHE[1]
+
+# The connect response and message ack differ only in their timestamp, so their JSON is encoded once here
+# and shared by every connection that sends them
+ACCEPT_PREFIX = b'{"status":"success","message":"Connection accepted","timestamp":"'
+ACK_PREFIX = b'{"status":"success","message":"Message received","timestamp":"'
+_RESPONSE_SUFFIX = b'"}'
+
+def timestamped_frame(prefix: bytes) -> bytes:
+    """Frame a pre-encoded response with the current timestamp filled in"""
+    payload = prefix + _now_str().encode('ascii') + _RESPONSE_SUFFIX
+    return HEADER.pack(len(payload)) + payload
+
+def recv_exact(sock: socket.socket, n: int) -> Optional[bytearray]:
+    """
+    Read exactly n bytes from a socket
+
+    Returns:
+        bytearray: The bytes read, or None if the peer closed the connection before sending any
+    """
+    buf = bytearray(n)
+    view = memoryview(buf)
+    received = 0
+    while received < n:
+        count = sock.recv_into(view[received:], n - received, _RECV_FLAGS)
+        if count == 0:
+            if received == 0:
+                return None
+            raise ConnectionError(f"Connection closed after {received} of {n} bytes")
+        received += count
+    return buf
+
+def encode_payload(message: dict) -> bytes:
+    """Encode one message as UTF-8 JSON bytes"""
+    return orjson.dumps(message) if orjson else _JSON_ENCODER.encode(message).encode('utf-8')
+
+def encode_wire(message: dict) -> bytes:
+    """Encode one message for sending, as MessagePack when enabled and JSON otherwise"""
+    return _MSGPACK_ENCODER.encode(message) if USE_MSGPACK else encode_payload(message)
+
+def encode_frame(message: dict) -> bytes:
+    """Encode one message with its length prefix"""
+    payload = encode_wire(message)
+    return HEADER.pack(len(payload)) + payload
+
+def decode_payload(body) -> dict:
+    """Decode the JSON or MessagePack body of one message"""
+    if body and body[0] not in _JSON_START:
+        if msgspec is None:
+            raise ValueError("Received a MessagePack message but msgspec is not installed")
+        return _MSGPACK_DECODER.decode(body)
+    return orjson.loads(body) if orjson else _JSON_DECODER.decode(str(body, 'utf-8'))
+
+def decode_message(body) -> Tuple[str, str]:
+    """Decode only the content and timestamp of a message frame"""
+    if msgspec is not None:
+        decoder = _MESSAGE_JSON_DECODER if body and body[0] in _JSON_START else _MESSAGE_MSGPACK_DECODER
+        frame = decoder.decode(body)
+        return frame.content, frame.timestamp
+    message = decode_payload(body)
+    return message['content'], message['timestamp']
+
+def peek_action(body) -> Optional[str]:
+    """
+    Read a JSON message's action without decoding the rest of it
+
+    Returns None, so the caller decodes the whole message, when the body is MessagePack or
+    "action" is not the first key of the top-level object.
+    """
+    if body and body[0] not in _JSON_START:
+        return None
+    match = _ACTION_FIELD.match(body)
+    return match.group(1).decode('utf-8') if match else None
+
+def split_frames(buffer, end: int) -> Tuple[List[bytearray], int]:
+    """
+    Copy out the body of every complete frame in buffer[:end] without modifying the buffer
+
+    Bodies are left encoded so the caller can decide from peek_action whether each is worth decoding.
+
+    Returns:
+        Tuple[List[bytearray], int]: The frame bodies, oldest first, and how many bytes they used
+    """
+    bodies = []
+    start = 0
+    while end - start >= HEADER.size:
+        (length,) = HEADER.unpack_from(buffer, start)
+        frame_end = start + HEADER.size + length
+        if end < frame_end:
+            break
+        bodies.append(buffer[start + HEADER.size:frame_end])
+        start = frame_end
+    return bodies, start
+
+def send_frame(sock: socket.socket, message: dict):
+    """Send one message with its length prefix"""
+    payload = encode_wire(message)
+    header = HEADER.pack(len(payload))
+    if len(payload) <= SENDMSG_THRESHOLD or not hasattr(sock, 'sendmsg'):
+        sock.sendall(header + payload)
+        return
+    # Gather the header and a large payload in one syscall instead of copying them together
+    sent = sock.sendmsg([header, payload])
+    if sent < HEADER.size:
+        sock.sendall(header[sent:])
+        sent = HEADER.size
+    if sent < HEADER.size + len(payload):
+        sock.sendall(memoryview(payload)[sent - HEADER.size:])
+
+def recv_frame(sock: socket.socket) -> Optional[dict]:
+    """
+    Receive one length-prefixed message
+
+    Returns:
+        dict: The decoded message, or None if the connection was closed
+        
+    Raises:
+        ConnectionError: The header claims a body larger than MAX_FRAME_SIZE; the caller should close the socket
+    """
+    header = recv_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    (length,) = HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ConnectionError(f"Frame of {length} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+    body = recv_exact(sock, length) if length else bytearray()
+    if body is None:
+        raise ConnectionError("Connection closed before message body")
+    return decode_payload(body)
+
+async def read_frame(reader: asyncio.StreamReader) -> Optional[dict]:
+    """
+    Receive one length-prefixed message from an asyncio stream
+
+    Returns:
+        dict: The decoded message, or None if the connection was closed
+        
+    Raises:
+        ConnectionError: The header claims a body larger than MAX_FRAME_SIZE; the caller should close the stream
+    """
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise ConnectionError("Connection closed inside message header")
+    (length,) = HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ConnectionError(f"Frame of {length} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+    body = await reader.readexactly(length)
+    return decode_payload(body)
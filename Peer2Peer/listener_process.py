@@ -1,13 +1,19 @@
 #!/usr/bin/env python3
 import socket
-import json
 import os
 import logging
+import logging.handlers
 import sys
 import time
-import select
-from typing import Dict, Optional
-from multiprocessing import Process
+import selectors
+import signal
+import queue
+import threading
+from typing import Dict, List, Optional
+from urllib.parse import quote, unquote
+from multiprocessing import Process, Value
+from framing import (HEADER, MAX_FRAME_SIZE, ACCEPT_PREFIX, ACK_PREFIX, encode_payload, decode_payload, decode_message,
+                     encode_frame, split_frames, peek_action, timestamped_frame)
 
 # Configure logging
 logging.basicConfig(
@@ -16,10 +22,91 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Seconds between history writes; messages arriving in between are saved together
+HISTORY_FLUSH_INTERVAL = 1.0
+
+# Encoded history records are held in memory up to this size, so they reach the OS in large writes
+HISTORY_BUFFER_SIZE = 64 * 1024
+
+# Most history records the writer thread encodes and writes in one call
+HISTORY_WRITE_BATCH = 256
+
+# Connections the kernel queues for accept; a burst of reconnecting peers is drained in one pass
+LISTEN_BACKLOG = 128
+
+# Initial size of each connection's receive buffer; it grows to fit larger frames
+RECV_BUFFER_SIZE = 64 * 1024
+
+# Most messages forwarded to the main process in one queue put
+QUEUE_BATCH_SIZE = 32
+# Seconds to wait for room in a full message queue before dropping a batch
+QUEUE_PUT_TIMEOUT = 0.5
+
+class PeerConnection:
+    """Read and write state for one peer socket"""
+
+    def __init__(self, sock: socket.socket, address: tuple):
+        self.sock = sock
+        self.address = address
+        self.username = None  # set once the peer's connection request arrives
+        # Preallocated once and received into directly, so reads allocate nothing
+        self.buffer = bytearray(RECV_BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+        self.filled = 0  # bytes at the start of buffer not yet forming a complete frame
+        self.needed = HEADER.size  # bytes that must be buffered before the next frame can be parsed
+        self.outbox = bytearray()  # framed replies the socket has not accepted yet
+        self.send_lock = threading.Lock()  # held while another thread writes a frame to the socket
+
+    def reserve(self, size: int):
+        """Grow the receive buffer so it holds at least size bytes"""
+        if size > len(self.buffer):
+            # A bytearray cannot be resized while a memoryview of it exists
+            self.view.release()
+            self.buffer.extend(bytes(size - len(self.buffer)))
+            self.view = memoryview(self.buffer)
+
+    def receive(self) -> Optional[List[bytearray]]:
+        """
+        Receive what the socket has ready into the buffer and take out every frame it completed
+        
+        Returns:
+            List[bytearray]: Bodies of the completed frames, oldest first; empty while a frame is still arriving
+            None: The peer closed the connection
+            
+        Raises:
+            ConnectionError: A header claims a body larger than MAX_FRAME_SIZE; the caller closes the connection
+        """
+        if self.filled == len(self.buffer):
+            self.reserve(2 * len(self.buffer))
+        count = self.sock.recv_into(self.view[self.filled:])
+        if count == 0:
+            return None
+
+        self.filled += count
+        # A large frame arrives over many reads; copy the bytes in and parse only once it is whole
+        if self.filled < self.needed:
+            return []
+        bodies, consumed = split_frames(self.buffer, self.filled)
+        # Slide any partial frame to the front and make room for the rest of it
+        remaining = self.filled - consumed
+        if consumed and remaining:
+            self.view[:remaining] = self.view[consumed:self.filled]
+        self.filled = remaining
+        self.needed = HEADER.size
+        if remaining >= HEADER.size:
+            (length,) = HEADER.unpack_from(self.buffer)
+            # Never grow the buffer to a size an unauthenticated peer merely claims
+            if length > MAX_FRAME_SIZE:
+                raise ConnectionError(f"Frame of {length} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+            self.needed += length
+            self.reserve(self.needed)
+        return bodies
+
 class ListenerProcess(Process):
     """Process that handles incoming connections and writes messages to user history"""
     
-    def __init__(self, host: str, port: int, username: str, data_dir: str, message_queue=None):
+    def __init__(self, host: str, port: int, username: str, data_dir: str, message_queue=None,
+                 reuse_port: bool = False):
         """
         Initialize the listener process
         
@@ -29,6 +116,8 @@ class ListenerProcess(Process):
             username: Username for this peer
             data_dir: Directory to store user data
             message_queue: Optional queue for communication with main process
+            reuse_port: Bind with SO_REUSEPORT, so several listener processes can share the port
+                and the kernel spreads incoming connections across them
         """
         super().__init__()  # Initialize the Process parent class
         self.host = host
@@ -36,14 +125,30 @@ class ListenerProcess(Process):
         self.username = username
         self.data_dir = data_dir
         self.message_queue = message_queue
+        self.reuse_port = reuse_port
+        # The port actually bound, set by the child process; 0 until then
+        self.bound_port = Value('i', 0)
+        self._queue_batch = []  # messages waiting to be sent to the main process in one put
+        self._log_listener = None  # writes queued log records in the listener process
         self.running = True
         self.socket = None
         
-        # Path to message history file
-        self.history_file = os.path.join(self.data_dir, f"{self.username}_history.json")
+        # Message history is kept per peer in {username}_history_{peer}.jsonl; one JSON record per
+        # line, only ever appended to, so a save touches only the peers that sent something
+        self.history_prefix = os.path.join(self.data_dir, f"{self.username}_history_")
+        self._history_fds = {}  # raw O_APPEND descriptor per peer, opened on the peer's first save
+        self._history_buffers = {}  # encoded records per peer not yet written
+        self._history_pending = 0  # bytes across all history buffers
         
         # Load existing message history if available
         self.message_history = self._load_history()
+
+        # Records are handed to a writer thread so file I/O never blocks the select loop; it marks
+        # them dirty and flushes at most once per HISTORY_FLUSH_INTERVAL
+        self._history_q = None
+        self._history_writer = None
+        self._dirty_peers = set()
+        self._last_history_flush = 0.0
     
     def _init_socket(self):
         """Initialize the listening socket"""
@@ -59,6 +164,8 @@ class ListenerProcess(Process):
             # Create a new socket
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.reuse_port:
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             
             # Try to bind to the specified host and port
             try:
@@ -72,12 +179,15 @@ class ListenerProcess(Process):
                     raise
             
             # Start listening for connections
-            self.socket.listen(5)
+            self.socket.listen(LISTEN_BACKLOG)
+            # Non-blocking so _accept_pending can take connections until none are left
+            self.socket.setblocking(False)
             
-            # Get the actual port if it was auto-assigned
+            # Get the actual port if it was auto-assigned, and tell the parent process which port it is
             if self.port == 0:
                 self.port = self.socket.getsockname()[1]
-                
+            self.bound_port.value = self.socket.getsockname()[1]
+
             logger.info(f"Successfully initialized listening socket on {self.host}:{self.port}")
             return True
         except Exception as e:
@@ -85,167 +195,358 @@ class ListenerProcess(Process):
             self.socket = None
             return False
     
+    def _history_path(self, peer_username: str) -> str:
+        """Path of the history file for one peer, with the name escaped so it is a single file name"""
+        return f"{self.history_prefix}{quote(peer_username, safe='')}.jsonl"
+
     def _load_history(self) -> Dict:
-        """Load message history from file"""
-        if os.path.exists(self.history_file):
+        """Load message history from every peer's file"""
+        history = {}
+        directory, prefix = os.path.split(self.history_prefix)
+        if not os.path.isdir(directory):
+            return history
+        for name in os.listdir(directory):
+            if not (name.startswith(prefix) and name.endswith('.jsonl')):
+                continue
+            peer_username = unquote(name[len(prefix):-len('.jsonl')])
             try:
-                with open(self.history_file, 'r') as f:
-                    return json.load(f)
+                with open(os.path.join(directory, name), 'rb') as f:
+                    history[peer_username] = [decode_payload(line) for line in f]
             except Exception as e:
-                logger.error(f"Error loading message history: {e}")
-        return {}
+                logger.error(f"Error loading message history for {peer_username}: {e}")
+        return history
+
+    def _append_history(self, peer_username: str, record: Dict):
+        """Queue one message record for the history writer thread"""
+        self._history_q.put((peer_username, record))
+
+    def _start_history_writer(self):
+        """Start the thread that appends queued history records to the file"""
+        self._history_q = queue.SimpleQueue()
+        self._history_writer = threading.Thread(target=self._history_writer_loop, daemon=True)
+        self._history_writer.start()
+
+    def _history_writer_loop(self):
+        """Write queued records in batches until a None record asks the thread to stop"""
+        while True:
+            try:
+                batch = [self._history_q.get(timeout=HISTORY_FLUSH_INTERVAL)]
+            except queue.Empty:
+                self._maybe_flush_history()
+                continue
+            while len(batch) < HISTORY_WRITE_BATCH and batch[-1] is not None:
+                try:
+                    batch.append(self._history_q.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = batch[-1] is None
+            if stop:
+                batch.pop()
+            for peer_username, record in batch:
+                try:
+                    line = encode_payload(record) + b'\n'
+                except Exception as e:
+                    logger.error(f"Error appending message history: {e}")
+                    continue
+                buffer = self._history_buffers.get(peer_username)
+                if buffer is None:
+                    buffer = self._history_buffers[peer_username] = bytearray()
+                buffer += line
+                self._history_pending += len(line)
+                self._dirty_peers.add(peer_username)
+            if stop:
+                return
+            if self._history_pending >= HISTORY_BUFFER_SIZE:
+                self._save_history()
+            else:
+                self._maybe_flush_history()
     
     def _save_history(self):
-        """Save message history to file"""
-        try:
-            with open(self.history_file, 'w') as f:
-                json.dump(self.message_history, f, indent=2)
-        except Exception as e:
-            logger.error(f"Error saving message history: {e}")
+        """Write buffered history records to the files of the peers that have any"""
+        for peer_username in list(self._dirty_peers):
+            buffer = self._history_buffers[peer_username]
+            try:
+                fd = self._history_fds.get(peer_username)
+                if fd is None:
+                    fd = self._history_fds[peer_username] = os.open(
+                        self._history_path(peer_username), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644
+                    )
+                with memoryview(buffer) as view:
+                    written = 0
+                    while written < len(view):
+                        written += os.write(fd, view[written:])
+            except Exception as e:
+                # Leave the peer dirty so the next save tries again
+                logger.error(f"Error saving message history for {peer_username}: {e}")
+                continue
+            self._history_pending -= len(buffer)
+            buffer.clear()
+            self._dirty_peers.discard(peer_username)
+        self._last_history_flush = time.monotonic()
+
+    def _maybe_flush_history(self):
+        """Save message history if it changed and the last save was at least HISTORY_FLUSH_INTERVAL ago"""
+        if self._dirty_peers and time.monotonic() - self._last_history_flush >= HISTORY_FLUSH_INTERVAL:
+            self._save_history()
+    
+    def _accept_pending(self):
+        """Accept every connection waiting on the listening socket, so a burst costs one wake-up"""
+        while True:
+            try:
+                client_socket, address = self.socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            self._accept_connection(client_socket, address)
     
-    def _handle_incoming_connection(self, client_socket: socket.socket, address: tuple):
+    def _accept_connection(self, client_socket: socket.socket, address: tuple):
         """
-        Handle an incoming connection
+        Start tracking an incoming connection
         
         Args:
             client_socket: Socket of the incoming connection
             address: Address of the incoming connection
         """
+        logger.info(f"Handling incoming connection from {address}")
+        # Replies are small acks; send them immediately instead of letting Nagle hold them back
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Let the kernel notice peers that vanished without closing the connection
+        client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        # Non-blocking so one slow peer never stalls the others sharing this process
+        client_socket.setblocking(False)
+        self._sel.register(client_socket, selectors.EVENT_READ, PeerConnection(client_socket, address))
+
+    def _read_connection(self, conn: 'PeerConnection'):
+        """Read whatever a peer has sent and handle every complete message in it"""
         try:
-            logger.info(f"Handling incoming connection from {address}")
-            
-            # Set a timeout for receiving the connection request
-            client_socket.settimeout(5)
-            
-            # Receive connection request
-            data = client_socket.recv(4096).decode('utf-8')
-            request = json.loads(data)
-            
-            # Reset timeout
-            client_socket.settimeout(None)
-            
-            if request['action'] != 'connect':
-                logger.warning(f"Invalid connection request from {address}: {request}")
+            bodies = conn.receive()
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            logger.error(f"Error handling incoming connection from {conn.address}: {e}")
+            self._close_connection(conn)
+            return
+
+        if bodies is None:
+            if conn.username:
+                logger.info(f"Connection closed by peer {conn.username}")
+            self._close_connection(conn)
+            return
+
+        try:
+            for body in bodies:
+                if not self._dispatch_frame(conn, body):
+                    self._close_connection(conn)
+                    return
+        except Exception as e:
+            logger.error(f"Error handling message from {conn.username or conn.address}: {e}")
+            self._close_connection(conn)
+
+    def _dispatch_frame(self, conn: 'PeerConnection', body: bytearray) -> bool:
+        """
+        Decode and handle one frame body, decoding only as much of it as its action needs
+        
+        Returns:
+            bool: False if the connection should be closed
+        """
+        expected = 'message' if conn.username else 'connect'
+        # MessagePack bodies peek as None and are decoded in full below
+        action = peek_action(body)
+        if action is not None and action != expected:
+            # The frame is rejected from its action alone, so skip decoding the rest of it
+            return self._handle_frame(conn, {'action': action})
+        if action == 'message':
+            # The common case: decode just the two fields a message needs, without building a dict
+            return self._handle_message(conn, *decode_message(body))
+        return self._handle_frame(conn, decode_payload(body))
+
+    def _handle_frame(self, conn: 'PeerConnection', message_data: Dict) -> bool:
+        """
+        Handle one decoded message from a peer
+        
+        Returns:
+            bool: False if the connection should be closed
+        """
+        if conn.username is None:
+            # The first message on a connection must be the connection request
+            if message_data['action'] != 'connect':
+                logger.warning(f"Invalid connection request from {conn.address}: {message_data}")
                 response = {
                     'status': 'error',
                     'message': 'Invalid connection request'
                 }
-                client_socket.send(json.dumps(response).encode('utf-8'))
-                return
+                self._send(conn, response)
+                return False
             
-            peer_username = request['username']
-            logger.info(f"Connection request from peer {peer_username} at {address}")
+            conn.username = message_data['username']
+            logger.info(f"Connection request from peer {conn.username} at {conn.address}")
             
             # Accept connection
-            response = {
-                'status': 'success',
-                'message': 'Connection accepted',
-                'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
-            }
-            
-            client_socket.send(json.dumps(response).encode('utf-8'))
-            logger.info(f"Connection accepted and response sent to {peer_username}")
-            
-            # Handle messages from this peer
-            while self.running:
-                try:
-                    logger.info(f"Waiting for message from {peer_username}")
-                    data = client_socket.recv(4096).decode('utf-8')
-                    if not data:
-                        logger.info(f"Connection closed by peer {peer_username}")
-                        break
-                    
-                    logger.info(f"Received data from {peer_username}: {data[:100]}...")
-                    message_data = json.loads(data)
-                    
-                    if message_data['action'] != 'message':
-                        logger.warning(f"Invalid message from {peer_username}: {message_data}")
-                        continue
-                    
-                    content = message_data['content']
-                    timestamp = message_data['timestamp']
-                    
-                    logger.info(f"Processing message from {peer_username}: {content[:50]}...")
-                    
-                    # Store message in history
-                    if peer_username not in self.message_history:
-                        self.message_history[peer_username] = []
-                    
-                    self.message_history[peer_username].append({
-                        'direction': 'incoming',
-                        'content': content,
-                        'timestamp': timestamp
-                    })
-                    
-                    # Save message history
-                    self._save_history()
-                    logger.info(f"Message history saved for {peer_username}")
-                    
-                    # Notify main process through message queue if available
-                    if self.message_queue:
-                        logger.info(f"Putting message in queue for main process: {content[:50]}...")
-                        self.message_queue.put({
-                            'type': 'message',
-                            'from': peer_username,
-                            'content': content,
-                            'timestamp': timestamp
-                        })
-                        logger.info("Message added to queue successfully")
-                    else:
-                        logger.warning("Message queue not available, message not forwarded to main process")
-                    
-                    # Send acknowledgment
-                    ack = {
-                        'status': 'success',
-                        'message': 'Message received',
-                        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
-                    }
-                    
-                    client_socket.send(json.dumps(ack).encode('utf-8'))
-                    logger.info(f"Acknowledgment sent to {peer_username}")
-                    
-                    # Print message
-                    print(f"\n[{peer_username}] {content}")
-                    
-                except socket.timeout:
-                    logger.info(f"Timeout waiting for message from {peer_username}")
-                    continue
-                except Exception as e:
-                    logger.error(f"Error handling message from {peer_username}: {e}")
-                    break
-            
-        except Exception as e:
-            logger.error(f"Error handling incoming connection from {address}: {e}")
-        finally:
+            self._send_frame(conn, timestamped_frame(ACCEPT_PREFIX))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Connection accepted and response sent to {conn.username}")
+            return True
+
+        peer_username = conn.username
+        # Per-message logs are debug only; formatting and writing them would dominate the message path
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug(f"Received data from {peer_username}: {str(message_data)[:100]}...")
+        
+        if message_data['action'] != 'message':
+            logger.warning(f"Invalid message from {peer_username}: {message_data}")
+            return True
+        
+        return self._handle_message(conn, message_data['content'], message_data['timestamp'])
+
+    def _handle_message(self, conn: 'PeerConnection', content: str, timestamp: str) -> bool:
+        """
+        Store, forward and acknowledge one message from a connected peer
+        
+        Returns:
+            bool: False if the connection should be closed
+        """
+        peer_username = conn.username
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug(f"Processing message from {peer_username}: {content[:50]}...")
+        
+        # Store message in history
+        if peer_username not in self.message_history:
+            self.message_history[peer_username] = []
+        
+        record = {
+            'direction': 'incoming',
+            'content': content,
+            'timestamp': timestamp
+        }
+        self.message_history[peer_username].append(record)
+        
+        # Append to the history file, flushed together with any other messages in this interval
+        self._append_history(peer_username, record)
+        
+        # Notify main process through message queue if available
+        if self.message_queue:
+            if debug:
+                logger.debug(f"Putting message in queue for main process: {content[:50]}...")
+            self._queue_batch.append({
+                'type': 'message',
+                'from': peer_username,
+                'content': content,
+                'timestamp': timestamp
+            })
+            if len(self._queue_batch) >= QUEUE_BATCH_SIZE:
+                self._flush_queue_batch()
+        else:
+            logger.warning("Message queue not available, message not forwarded to main process")
+        
+        # Send acknowledgment
+        self._send_frame(conn, timestamped_frame(ACK_PREFIX))
+        if debug:
+            logger.debug(f"Acknowledgment sent to {peer_username}")
+        
+        # Print message
+        print(f"\n[{peer_username}] {content}")
+        return True
+
+    def _flush_queue_batch(self):
+        """Send the pending messages to the main process as one list, so they share one encode and write"""
+        if not self._queue_batch:
+            return
+        batch, self._queue_batch = self._queue_batch, []
+        try:
+            self.message_queue.put_nowait(batch)
+        except queue.Full:
+            # The main process is falling behind; wait briefly, then drop rather than grow without bound
             try:
-                client_socket.close()
-                logger.info(f"Connection to {address} closed")
-            except:
-                pass
+                self.message_queue.put(batch, timeout=QUEUE_PUT_TIMEOUT)
+            except queue.Full:
+                logger.error(f"Message queue full, dropped {len(batch)} messages for the main process")
+                return
+        except ValueError as e:
+            logger.error(f"Dropped {len(batch)} messages for the main process: {e}")
+            return
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Added {len(batch)} messages to queue successfully")
+
+    def _send(self, conn: 'PeerConnection', message: Dict):
+        """Queue a framed message for a peer and send as much of it as the socket accepts now"""
+        self._send_frame(conn, encode_frame(message))
+
+    def _send_frame(self, conn: 'PeerConnection', frame: bytes):
+        """Queue an already framed message for a peer and send as much of it as the socket accepts now"""
+        conn.outbox += frame
+        self._write_connection(conn)
+
+    def _write_connection(self, conn: 'PeerConnection'):
+        """Send queued bytes, watching for writability only while some are left over"""
+        try:
+            sent = conn.sock.send(conn.outbox)
+            del conn.outbox[:sent]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError as e:
+            logger.error(f"Error sending to {conn.username or conn.address}: {e}")
+            self._close_connection(conn)
+            return
+
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if conn.outbox else 0)
+        if self._sel.get_key(conn.sock).events != events:
+            self._sel.modify(conn.sock, events, conn)
+
+    def _close_connection(self, conn: 'PeerConnection'):
+        """Stop tracking a peer connection and close its socket"""
+        try:
+            self._sel.unregister(conn.sock)
+        except (KeyError, ValueError):
+            pass
+        try:
+            conn.sock.close()
+            logger.info(f"Connection to {conn.address} closed")
+        except:
+            pass
     
     def run(self):
         """Override Process.run() to start the listener process"""
+        self._start_log_listener()
         logger.info(f"Starting listener process for {self.username} on {self.host}:{self.port}")
         
-        # Initialize socket in the child process
+        # Initialize socket in the child process; the selector uses epoll/kqueue where available
+        self._sel = selectors.DefaultSelector()
         self._init_socket()
+        self._register_listener()
+        self._start_history_writer()
+
+        # terminate() sends SIGTERM; stop the loop so pending history is saved before exiting
+        signal.signal(signal.SIGTERM, self._handle_terminate)
         
-        # Use select to handle multiple connections efficiently
+        # Use the selector to handle multiple connections efficiently
         while self.running:
             try:
-                # Use select with a timeout to allow checking self.running periodically
-                readable, _, _ = select.select([self.socket], [], [], 1.0)
+                # Wait with a timeout to allow checking self.running periodically
+                events = self._sel.select(1.0)
                 
-                if self.socket in readable:
-                    client_socket, address = self.socket.accept()
-                    # Handle the connection in a non-blocking way
-                    self._handle_incoming_connection(client_socket, address)
+                for key, mask in events:
+                    if key.fileobj is self.socket:
+                        self._accept_pending()
+                        continue
+                    # A connection may have been closed earlier in this batch of events
+                    if key.fileobj.fileno() == -1:
+                        continue
+                    if mask & selectors.EVENT_WRITE:
+                        self._write_connection(key.data)
+                    if mask & selectors.EVENT_READ and key.fileobj.fileno() != -1:
+                        self._read_connection(key.data)
+
+                # Forward everything received in this pass together
+                self._flush_queue_batch()
             except (socket.error, OSError) as e:
                 if self.running:
                     logger.error(f"Socket error in listener process: {e}")
                     # Try to reinitialize the socket
                     try:
                         if self.socket:
+                            self._sel.unregister(self.socket)
                             self.socket.close()
                     except:
                         pass
@@ -256,6 +557,7 @@ class ListenerProcess(Process):
                     try:
                         logger.info("Attempting to reinitialize socket...")
                         self._init_socket()
+                        self._register_listener()
                         logger.info("Socket reinitialized successfully")
                     except Exception as reconnect_error:
                         logger.error(f"Failed to reinitialize socket: {reconnect_error}")
@@ -265,11 +567,63 @@ class ListenerProcess(Process):
                 if self.running:
                     logger.error(f"Error accepting connection: {e}")
                     time.sleep(1)  # Prevent tight loop on persistent errors
+
+        for key in list(self._sel.get_map().values()):
+            if key.data is not None:
+                self._close_connection(key.data)
+        self._sel.close()
+        self._close_history()
+        self._stop_log_listener()
+
+    def _start_log_listener(self):
+        """Route this process's log records through a queue so handler writes happen off the select loop"""
+        root = logging.getLogger()
+        log_queue = queue.SimpleQueue()
+        self._log_listener = logging.handlers.QueueListener(log_queue, *root.handlers, respect_handler_level=True)
+        root.handlers = [logging.handlers.QueueHandler(log_queue)]
+        self._log_listener.start()
+
+    def _stop_log_listener(self):
+        """Write out any queued log records and restore the original handlers"""
+        if self._log_listener is not None:
+            self._log_listener.stop()
+            logging.getLogger().handlers = list(self._log_listener.handlers)
+            self._log_listener = None
+
+    def _register_listener(self):
+        """Watch the listening socket for new connections"""
+        if self.socket:
+            self._sel.register(self.socket, selectors.EVENT_READ)
+
+    def _close_history(self):
+        """Write out queued records, then flush and close the history files"""
+        if self._history_writer is not None:
+            self._history_q.put(None)
+            self._history_writer.join()
+            self._history_writer = None
+        if self._dirty_peers:
+            self._save_history()
+        # Periodic flushes leave durability to the OS; sync once when the process stops
+        for peer_username, fd in self._history_fds.items():
+            try:
+                os.fsync(fd)
+            except OSError as e:
+                logger.error(f"Error syncing message history for {peer_username}: {e}")
+            os.close(fd)
+        self._history_fds.clear()
+
+    def _handle_terminate(self, signum, frame):
+        """Stop the listener loop when the process is asked to terminate"""
+        logger.info(f"Received signal {signum}, stopping listener process...")
+        self.running = False
     
     def shutdown(self):
         """Shutdown the listener process"""
         logger.info("Shutting down listener process...")
         self.running = False
+
+        # Save any messages still waiting for the next periodic flush
+        self._close_history()
         
         try:
             if self.socket:
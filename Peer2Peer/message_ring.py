@@ -0,0 +1,137 @@
+import os
+import queue
+import struct
+import time
+import multiprocessing
+import multiprocessing.connection
+from typing import List, Optional
+from framing import encode_payload, decode_payload
+
+# Shared memory is missing on some minimal Python builds; callers fall back to multiprocessing.Queue
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+# Bytes of shared memory the listener can fill before the main process has to catch up
+RING_SIZE = 4 * 1024 * 1024
+
+# Seconds a blocking put sleeps between checks for room in a full ring
+RING_POLL_INTERVAL = 0.005
+
+# Each batch in the ring is a 4-byte big-endian length followed by that many bytes of JSON
+_RECORD_HEADER = struct.Struct(">I")
+
+class MessageRing:
+    """
+    Multi-producer, single-consumer queue of message batches in shared memory
+
+    Listener processes are the writers and the peer client's message thread the only reader.
+    Batches are copied in as length-prefixed JSON, so unlike multiprocessing.Queue there is no
+    pickling or feeder thread. A pipe is written to only when the reader is waiting on an empty
+    ring, so an idle reader sleeps in the kernel instead of polling. Supports the put_nowait/put/get/empty/close
+    subset of the multiprocessing.Queue interface the peer client and listener use.
+    """
+
+    def __init__(self, size: int = RING_SIZE):
+        if shared_memory is None:
+            raise OSError("multiprocessing.shared_memory is not available")
+        self.size = size
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        self._owner_pid = os.getpid()
+        # Total bytes ever written and read; ring offsets are these modulo size. Reading and
+        # writing them takes their locks, which also orders the data copies on either side.
+        # A writer holds the tail lock for its whole put, so several listener processes can share the ring
+        self._tail = multiprocessing.Value('Q', 0)
+        self._head = multiprocessing.Value('Q', 0)
+        # Doorbell the writers ring to wake a reader waiting on an empty ring; the reader sets
+        # _waiting before it sleeps, so a busy reader costs the writers no pipe writes
+        self._doorbell_r, self._doorbell_w = multiprocessing.Pipe(duplex=False)
+        self._waiting = multiprocessing.Value('b', 0)
+
+    def _write(self, position: int, data):
+        """Copy data into the ring starting at an absolute position, wrapping at the end"""
+        start = position % self.size
+        first = min(len(data), self.size - start)
+        self._shm.buf[start:start + first] = data[:first]
+        if first < len(data):
+            self._shm.buf[:len(data) - first] = data[first:]
+
+    def _read(self, position: int, length: int) -> bytes:
+        """Copy length bytes out of the ring starting at an absolute position"""
+        start = position % self.size
+        end = start + length
+        if end <= self.size:
+            return bytes(self._shm.buf[start:end])
+        return bytes(self._shm.buf[start:]) + bytes(self._shm.buf[:end - self.size])
+
+    def _put_payload(self, payload: bytes) -> bool:
+        """Append one encoded batch if there is room for it"""
+        with self._tail.get_lock():
+            tail = self._tail.value
+            if self.size - (tail - self._head.value) < _RECORD_HEADER.size + len(payload):
+                return False
+            self._write(tail, _RECORD_HEADER.pack(len(payload)))
+            self._write(tail + _RECORD_HEADER.size, memoryview(payload))
+            # Publish the batch only once all of its bytes are in place
+            self._tail.value = tail + _RECORD_HEADER.size + len(payload)
+            if self._waiting.value:
+                self._waiting.value = 0
+                self._doorbell_w.send_bytes(b'')
+            return True
+
+    def _encode(self, batch: List[dict]) -> bytes:
+        """Encode a batch, rejecting one that could never fit in the ring"""
+        payload = encode_payload(batch)
+        if _RECORD_HEADER.size + len(payload) > self.size:
+            raise ValueError(f"Batch of {len(payload)} bytes is larger than the {self.size} byte message ring")
+        return payload
+
+    def put_nowait(self, batch: List[dict]):
+        """Add a batch, raising queue.Full if the reader has not made room for it"""
+        if not self._put_payload(self._encode(batch)):
+            raise queue.Full
+
+    def put(self, batch: List[dict], timeout: Optional[float] = None):
+        """Add a batch, waiting up to timeout seconds for room before raising queue.Full"""
+        payload = self._encode(batch)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._put_payload(payload):
+            if deadline is not None and time.monotonic() >= deadline:
+                raise queue.Full
+            time.sleep(RING_POLL_INTERVAL)
+
+    def get(self, block: bool = True, timeout: Optional[float] = None) -> List[dict]:
+        """Remove and return the oldest batch, raising queue.Empty if none arrives in time"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            head = self._head.value
+            if self._tail.value != head:
+                break
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if not block or (remaining is not None and remaining <= 0):
+                raise queue.Empty
+            # Check again once _waiting is set: a put before this returns here, one after it rings
+            self._waiting.value = 1
+            if self._tail.value != head:
+                continue
+            multiprocessing.connection.wait([self._doorbell_r], remaining)
+            while self._doorbell_r.poll():
+                self._doorbell_r.recv_bytes()
+
+        (length,) = _RECORD_HEADER.unpack(self._read(head, _RECORD_HEADER.size))
+        batch = decode_payload(self._read(head + _RECORD_HEADER.size, length))
+        self._head.value = head + _RECORD_HEADER.size + length
+        return batch
+
+    def empty(self) -> bool:
+        """Whether there is currently no batch to read"""
+        return self._head.value == self._tail.value
+
+    def close(self):
+        """Release this process's mapping, removing the shared memory if this process created it"""
+        self._doorbell_r.close()
+        self._doorbell_w.close()
+        self._shm.close()
+        if os.getpid() == self._owner_pid:
+            self._shm.unlink()
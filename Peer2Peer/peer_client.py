@@ -6,25 +6,120 @@ import time
 import os
 import sys
 import logging
+import logging.handlers
 import argparse
-import select
+import atexit
 import datetime
 import asyncio
 import multiprocessing
-from typing import Dict, List, Optional, Tuple, Union
-from listener_process import ListenerProcess
+import queue
+import collections
+import multiprocessing.connection
+from typing import Deque, Dict, List, Optional, Tuple, Union
+from listener_process import ListenerProcess, PeerConnection
+from framing import HEADER, MAX_FRAME_SIZE, ACCEPT_PREFIX, ACK_PREFIX, timestamped_frame, encode_payload, decode_payload, encode_frame, split_frames, send_frame, recv_frame, read_frame
+from message_ring import MessageRing
 
 # Configure logging
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Log records held in memory before they are written to the log file together
+LOG_BUFFER_CAPACITY = 64
+
+_log_file_handler = logging.handlers.RotatingFileHandler('peer_client.log', maxBytes=10 * 1024 * 1024, backupCount=3)
+_log_file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
+    format=LOG_FORMAT,
     handlers=[
-        logging.FileHandler('peer_client.log'),
+        # Written to the file in batches; warnings and errors flush the batch straight away
+        logging.handlers.MemoryHandler(LOG_BUFFER_CAPACITY, flushLevel=logging.WARNING, target=_log_file_handler),
         logging.StreamHandler()
     ]
 )
 logger = logging.getLogger(__name__)
 
+# orjson reads and writes the profile, history and directory files several times faster than
+# the json module; fall back when it is not installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _read_json(path: str):
+    """Read a JSON file"""
+    with open(path, 'rb') as f:
+        return orjson.loads(f.read()) if orjson else json.load(f)
+
+def _write_json(path: str, data):
+    """Write data to a JSON file, indented so it stays readable"""
+    # Replace the file in one step so a crash cannot leave it half written
+    temp_path = f"{path}.tmp"
+    if orjson:
+        with open(temp_path, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    else:
+        with open(temp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+    os.replace(temp_path, path)
+
+def _tune_tcp_socket(sock):
+    """Send small messages immediately instead of letting Nagle hold them back, and let the kernel notice peers that vanished"""
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+# Seconds a directory server query result is reused before the server is asked again
+DIRECTORY_CACHE_TTL = 30.0
+
+# Listener processes to run. Each one loads the message history, so there is one unless
+# PEER_LISTENER_PROCESSES asks for more; extra ones share the listener's port through SO_REUSEPORT
+# and the kernel spreads connections to that port across them. The port registered with the
+# directory is the client's own, so this only helps peers that connect to the listener port.
+# Platforms without SO_REUSEPORT always run one
+LISTENER_PROCESSES = max(1, int(os.environ.get('PEER_LISTENER_PROCESSES', '1'))) if hasattr(socket, 'SO_REUSEPORT') else 1
+
+# Most seconds the listener monitor sleeps before checking whether the client is shutting down
+LISTENER_MONITOR_INTERVAL = 5.0
+
+# Seconds between flushes of the history log's write buffer to the OS
+HISTORY_FLUSH_INTERVAL = 1.0
+
+# Seconds a changed profile or local directory waits before it is written, so a burst of
+# changes costs one write of each file
+STATE_FLUSH_INTERVAL = 5.0
+
+# Seconds between folds of the history log into the history snapshot file
+HISTORY_COMPACT_INTERVAL = 300.0
+
+# History log records are buffered up to this size before they are written out
+HISTORY_LOG_BUFFER_SIZE = 64 * 1024
+
+# Most message batches the listener process may queue before it has to wait, when the
+# shared-memory message ring is unavailable and a multiprocessing.Queue is used instead
+MESSAGE_QUEUE_SIZE = 4096
+
+# Longest the message thread waits on an empty message queue before checking whether to stop
+MESSAGE_WAIT_TIMEOUT = 0.5
+
+# Seconds send_message waits for an acknowledgment when the caller asks for confirmation
+ACK_TIMEOUT = 5.0
+
+# Most connections we keep open to peers; past this the least recently used one is closed
+PEER_POOL_SIZE = 64
+
+# Seconds a connection we opened may go unused before it is closed
+PEER_IDLE_TIMEOUT = 300.0
+
+class PendingAck:
+    """A sent message waiting for the peer's acknowledgment"""
+
+    def __init__(self, peer_username: str, entry: Dict):
+        self.peer_username = peer_username
+        self.entry = entry  # history entry recorded once the message is acknowledged
+        self.delivered = False
+        self.event = threading.Event()  # set once the acknowledgment arrives or the connection is lost
+
 class PeerClient:
     """Peer-to-Peer Client for the messaging system"""
     
@@ -50,6 +145,9 @@ class PeerClient:
         self.directory_port = directory_port
         self.test_mode = test_mode
         self.data_dir = data_dir
+
+        # Outbound IP found by _get_local_ip; it rarely changes, so it is looked up once
+        self._cached_local_ip: Optional[str] = None
         
         # Initialize socket with proper error handling
         try:
@@ -66,18 +164,39 @@ class PeerClient:
         except Exception as e:
             logger.error(f"Failed to initialize socket: {e}")
             raise
+
+        # One asyncio event loop, run on the receive thread, accepts incoming connections and watches
+        # peer sockets, instead of a receive thread plus a thread per incoming connection
+        self._loop = asyncio.new_event_loop()
         
         # Store connected peers
-        self.connected_peers: Dict[socket.socket, tuple] = {}  # socket -> (peer_username, peer_address)
-        self.peer_usernames: Dict[socket.socket, str] = {}  # socket -> username
+        # Connections we opened, keyed by peer; each PeerConnection holds the socket, address and receive buffer
+        self.connected_peers: Dict[str, PeerConnection] = {}  # username -> connection
+        self.incoming_peers: Dict[str, asyncio.StreamWriter] = {}  # username -> stream of a connection the peer opened
+        self._peer_connections: Dict[socket.socket, PeerConnection] = {}  # socket -> the same connection, for event loop callbacks
+        # Messages sent on each socket and not yet acknowledged, oldest first. A peer acknowledges the
+        # messages on a connection in the order they were sent, so each ack settles the oldest one
+        self._pending_acks: Dict[socket.socket, Deque[PendingAck]] = {}
+        # When each connection we opened was last used, least recently used first
+        self._peer_last_used: Dict[socket.socket, float] = collections.OrderedDict()
+        # Guards the two maps above, which both the event loop and the threads sending messages change.
+        # Reentrant so a sweep holding it can close connections with _forget_peer_socket
+        self._pool_lock = threading.RLock()
         
         # Store blocked and muted users
         self.blocked_users: set = set()
-        self.muted_users: set = set()
+        self.muted_users: Dict[str, datetime.datetime] = {}  # username -> when the mute expires
         
         # Store message history
         self.message_history: Dict[str, List[Dict]] = {}  # username -> list of messages
         
+        # One connection to the directory server is kept open and shared by every request to it
+        self._dir_sock: Optional[socket.socket] = None
+        self._dir_lock = threading.Lock()
+        
+        # Recent directory server query results: (query_type, search_term) -> (time fetched, response)
+        self._dir_cache: Dict[Tuple[str, str], Tuple[float, Dict]] = {}
+        
         # Store local directory of contacts
         self.local_directory: Dict[str, Dict] = {}  # username -> user_info
         
@@ -90,6 +209,16 @@ class PeerClient:
         # Path to message history file
         self.history_file = os.path.join(data_dir, f"{self.username}_history.json") if self.username else None
         
+        # New history entries are appended to this log as length-prefixed records instead of rewriting
+        # the whole history file per message; the log is folded into history_file periodically
+        self.history_log_file = f"{self.history_file}.log" if self.username else None
+        self._history_log = None
+        self._history_lock = threading.Lock()
+        
+        # Names of the files ('profile', 'directory') changed since they were last written
+        self._dirty: set = set()
+        self._dirty_lock = threading.Lock()
+        
         # Path to local directory file
         self.directory_file = os.path.join(data_dir, f"{self.username}_directory.json") if self.username else None
         
@@ -106,15 +235,15 @@ class PeerClient:
         self.running = True
         
         # Create a queue for communication between the main process and the asyncio process
-        self.message_queue = multiprocessing.Queue()
+        self.message_queue = self._create_message_queue()
         
         # Start the message receiving thread
-        self.receive_thread = threading.Thread(target=self._receive_messages)
+        self.receive_thread = threading.Thread(target=self._run_event_loop)
         self.receive_thread.daemon = True
         self.receive_thread.start()
         
-        # Start listener process
-        self.listener_process = None
+        # Start listener processes
+        self.listener_processes: List[ListenerProcess] = []
         self.start_listener_process()
         
         # Start message handling thread
@@ -122,19 +251,30 @@ class PeerClient:
         self.message_thread.daemon = True
         self.message_thread.start()
         
+        # Write any changes still pending if the interpreter exits without a shutdown
+        atexit.register(self._flush_dirty)
+        
+        # Start the thread that flushes and compacts the history log and writes changed files
+        self.history_thread = threading.Thread(target=self._maintain_history)
+        self.history_thread.daemon = True
+        self.history_thread.start()
+        
         logger.info(f"Peer client initialized on {self.host}:{self.port}")
     
     def _load_profile(self):
         """Load user profile from file"""
         try:
-            with open(self.profile_file, 'r') as f:
-                profile = json.load(f)
-                self.username = profile.get('username', self.username)
-                self.host = profile.get('host', self.host)
-                self.port = profile.get('port', self.port)
-                self.blocked_users = set(profile.get('blocked_users', []))
-                self.muted_users = set(username for username, expiry in profile.get('muted_users', {}).items())
-                logger.info(f"Loaded profile for user {self.username}")
+            profile = _read_json(self.profile_file)
+            self.username = profile.get('username', self.username)
+            self.host = profile.get('host', self.host)
+            self.port = profile.get('port', self.port)
+            self.blocked_users = set(profile.get('blocked_users', []))
+            # Expiry times are parsed once here rather than on every connect and send
+            self.muted_users = {
+                username: datetime.datetime.fromisoformat(expiry)
+                for username, expiry in profile.get('muted_users', {}).items()
+            }
+            logger.info(f"Loaded profile for user {self.username}")
         except Exception as e:
             logger.error(f"Error loading profile: {e}")
     
@@ -151,41 +291,133 @@ class PeerClient:
                 'blocked_users': list(self.blocked_users),
                 'muted_users': {
                     username: expiry.isoformat()
-                    for username, expiry in self.muted_users
+                    for username, expiry in self.muted_users.items()
                 }
             }
             
-            with open(self.profile_file, 'w') as f:
-                json.dump(profile, f, indent=2)
+            _write_json(self.profile_file, profile)
                 
             logger.info(f"Saved profile for user {self.username}")
         except Exception as e:
             logger.error(f"Error saving profile: {e}")
     
     def _load_history(self):
-        """Load message history from file"""
+        """Load message history from the snapshot file, then replay entries appended to the history log since"""
         if not self.username:
             return
             
         try:
-            with open(self.history_file, 'r') as f:
-                self.message_history = json.load(f)
-                logger.info(f"Loaded message history for user {self.username}")
+            self.message_history = _read_json(self.history_file)
+            logger.info(f"Loaded message history for user {self.username}")
         except Exception as e:
             logger.error(f"Error loading message history: {e}")
+            
+        try:
+            with open(self.history_log_file, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b''
+        except Exception as e:
+            logger.error(f"Error reading message history log: {e}")
+            data = b''
+            
+        # A record cut short by a crash is left out; the next compaction drops it
+        bodies, _ = split_frames(data, len(data))
+        for body in bodies:
+            try:
+                record = decode_payload(body)
+            except ValueError as e:
+                logger.error(f"Skipping unreadable message history record: {e}")
+                continue
+            self.message_history.setdefault(record['peer'], []).append(record['entry'])
+        if bodies:
+            logger.info(f"Replayed {len(bodies)} logged history entries for user {self.username}")
+    
+    def _record_history(self, peer_username: str, entry: Dict):
+        """Add a message to the history and append it to the history log"""
+        with self._history_lock:
+            self.message_history.setdefault(peer_username, []).append(entry)
+            if not self.username:
+                return
+            try:
+                if self._history_log is None:
+                    self._history_log = open(self.history_log_file, 'ab', buffering=HISTORY_LOG_BUFFER_SIZE)
+                payload = encode_payload({'peer': peer_username, 'entry': entry})
+                self._history_log.write(HEADER.pack(len(payload)) + payload)
+            except Exception as e:
+                logger.error(f"Error logging message history: {e}")
     
     def _save_history(self):
-        """Save message history to file"""
+        """Compact the history: write the whole history to the snapshot file and empty the history log"""
         if not self.username:
             return
             
-        try:
-            with open(self.history_file, 'w') as f:
-                json.dump(self.message_history, f, indent=2)
+        with self._history_lock:
+            try:
+                _write_json(self.history_file, self.message_history)
                 
-            logger.info(f"Saved message history for user {self.username}")
-        except Exception as e:
-            logger.error(f"Error saving message history: {e}")
+                if self._history_log is not None:
+                    self._history_log.close()
+                    self._history_log = None
+                if os.path.exists(self.history_log_file):
+                    os.remove(self.history_log_file)
+                    
+                logger.info(f"Saved message history for user {self.username}")
+            except Exception as e:
+                logger.error(f"Error saving message history: {e}")
+    
+    def _flush_history_log(self):
+        """Push buffered history log records to the OS"""
+        with self._history_lock:
+            if self._history_log is not None:
+                try:
+                    self._history_log.flush()
+                except Exception as e:
+                    logger.error(f"Error flushing message history log: {e}")
+    
+    def _mark_dirty(self, name: str):
+        """Note that the profile or local directory changed; it is written within STATE_FLUSH_INTERVAL"""
+        with self._dirty_lock:
+            self._dirty.add(name)
+    
+    def _flush_dirty(self):
+        """Write every file marked dirty since the last flush"""
+        with self._dirty_lock:
+            dirty = self._dirty
+            self._dirty = set()
+        if 'profile' in dirty:
+            self._save_profile()
+        if 'directory' in dirty:
+            self._save_directory()
+    
+    def _expire_mutes(self):
+        """Remove mutes that have expired, so users muted and never heard from again do not pile up"""
+        now = datetime.datetime.now()
+        expired = [username for username, expiry in list(self.muted_users.items()) if expiry <= now]
+        for username in expired:
+            self.muted_users.pop(username, None)
+        if expired:
+            logger.info(f"Removed {len(expired)} expired mutes")
+            self._mark_dirty('profile')
+    
+    def _maintain_history(self):
+        """
+        Flush the history log every HISTORY_FLUSH_INTERVAL, compact it every HISTORY_COMPACT_INTERVAL,
+        and every STATE_FLUSH_INTERVAL drop expired mutes and write a changed profile or local directory
+        """
+        last_compaction = last_state_flush = time.monotonic()
+        while self.running:
+            time.sleep(HISTORY_FLUSH_INTERVAL)
+            if time.monotonic() - last_state_flush >= STATE_FLUSH_INTERVAL:
+                self._expire_mutes()
+                self._flush_dirty()
+                last_state_flush = time.monotonic()
+            if time.monotonic() - last_compaction >= HISTORY_COMPACT_INTERVAL:
+                if self._history_log is not None:
+                    self._save_history()
+                last_compaction = time.monotonic()
+            else:
+                self._flush_history_log()
     
     def _load_directory(self):
         """Load local directory from file"""
@@ -193,9 +425,8 @@ class PeerClient:
             return
             
         try:
-            with open(self.directory_file, 'r') as f:
-                self.local_directory = json.load(f)
-                logger.info(f"Loaded local directory with {len(self.local_directory)} contacts")
+            self.local_directory = _read_json(self.directory_file)
+            logger.info(f"Loaded local directory with {len(self.local_directory)} contacts")
         except Exception as e:
             logger.error(f"Error loading local directory: {e}")
     
@@ -205,8 +436,7 @@ class PeerClient:
             return
             
         try:
-            with open(self.directory_file, 'w') as f:
-                json.dump(self.local_directory, f, indent=2)
+            _write_json(self.directory_file, self.local_directory)
                 
             logger.info(f"Saved local directory with {len(self.local_directory)} contacts")
         except Exception as e:
@@ -229,11 +459,11 @@ class PeerClient:
                 logger.error("Cannot add user to local directory: username not found in user info")
                 return False
                 
-            # Add user to local directory
-            self.local_directory[username] = user_info
+            # Add user to local directory; copy it, since user_info may belong to a cached directory response
+            self.local_directory[username] = dict(user_info)
             
             # Save local directory
-            self._save_directory()
+            self._mark_dirty('directory')
             
             logger.info(f"Added {username} to local directory")
             return True
@@ -256,7 +486,7 @@ class PeerClient:
                 del self.local_directory[username]
                 
                 # Save local directory
-                self._save_directory()
+                self._mark_dirty('directory')
                 
                 logger.info(f"Removed {username} from local directory")
                 return True
@@ -276,59 +506,350 @@ class PeerClient:
         """
         return self.local_directory
     
-    def _receive_messages(self):
-        """Thread function to receive messages from connected peers"""
+    def _track_peer_socket(self, peer_socket: socket.socket, peer_username: str, address: tuple):
+        """Record a peer connection and watch it for incoming messages"""
+        conn = PeerConnection(peer_socket, address)
+        conn.username = peer_username
+        self.connected_peers[peer_username] = conn
+        self._peer_connections[peer_socket] = conn
+        self._loop.call_soon_threadsafe(self._loop.add_reader, peer_socket, self._on_peer_readable, peer_socket)
+        
+        with self._pool_lock:
+            self._peer_last_used[peer_socket] = time.monotonic()
+            # Make room by closing the least recently used connection that has nothing in flight
+            if len(self._peer_last_used) > PEER_POOL_SIZE:
+                for idle_socket in list(self._peer_last_used):
+                    if idle_socket is not peer_socket and not self._pending_acks.get(idle_socket):
+                        logger.info(f"Closing least recently used connection to {self._peer_username(idle_socket)}")
+                        self._forget_peer_socket(idle_socket)
+                        break
+
+    def _peer_username(self, peer_socket: socket.socket) -> Optional[str]:
+        """Username of the peer on a connection we opened, or None if it is no longer tracked"""
+        conn = self._peer_connections.get(peer_socket)
+        return conn.username if conn is not None else None
+
+    def _peer_socket(self, peer_username: str) -> Optional[socket.socket]:
+        """Socket of our open connection to a peer, or None if there is none"""
+        conn = self.connected_peers.get(peer_username)
+        return conn.sock if conn is not None else None
+
+    def _touch_peer_socket(self, peer_socket: socket.socket):
+        """Mark a connection we opened as just used"""
+        with self._pool_lock:
+            if peer_socket in self._peer_last_used:
+                self._peer_last_used[peer_socket] = time.monotonic()
+                self._peer_last_used.move_to_end(peer_socket)
+
+    def _expect_ack(self, peer_socket: socket.socket, sent: PendingAck) -> bool:
+        """
+        Queue a message about to be sent on a connection we opened for its acknowledgment
+
+        Returns:
+            bool: False if the connection was closed in the meantime, so the message must not be sent
+        """
+        with self._pool_lock:
+            if peer_socket not in self._peer_last_used:
+                return False
+            self._touch_peer_socket(peer_socket)
+            self._pending_acks.setdefault(peer_socket, collections.deque()).append(sent)
+            return True
+
+    def _close_idle_peers(self):
+        """Close connections we opened that have been unused for PEER_IDLE_TIMEOUT seconds"""
+        cutoff = time.monotonic() - PEER_IDLE_TIMEOUT
+        with self._pool_lock:
+            for peer_socket, last_used in list(self._peer_last_used.items()):
+                if last_used > cutoff:
+                    # Later entries were used more recently still
+                    break
+                if not self._pending_acks.get(peer_socket):
+                    logger.info(f"Closing idle connection to {self._peer_username(peer_socket)}")
+                    self._forget_peer_socket(peer_socket)
+
+    def _forget_peer_socket(self, peer_socket: socket.socket):
+        """Stop watching a peer connection, drop it from the connection maps and close it"""
+        conn = self._peer_connections.pop(peer_socket, None)
+        with self._pool_lock:
+            self._peer_last_used.pop(peer_socket, None)
+            unacknowledged = self._pending_acks.pop(peer_socket, ())
+        # Messages still waiting for an acknowledgment on this connection will never get one
+        for sent in unacknowledged:
+            logger.error(f"Connection to {sent.peer_username} lost before message was acknowledged")
+            sent.event.set()
+        # A newer connection to the same peer may have replaced this one
+        if conn is not None and self.connected_peers.get(conn.username) is conn:
+            del self.connected_peers[conn.username]
+        # The event loop must stop watching the socket before it is closed
+        try:
+            self._loop.call_soon_threadsafe(self._close_watched_socket, peer_socket)
+        except RuntimeError:
+            # The event loop has already stopped
+            self._close_watched_socket(peer_socket)
+
+    def _settle_ack(self, peer_socket: socket.socket, ack: Dict):
+        """Match an acknowledgment to the oldest unacknowledged message sent on its socket"""
+        with self._pool_lock:
+            pending = self._pending_acks.get(peer_socket)
+            sent = pending.popleft() if pending else None
+        if sent is None:
+            logger.warning(f"Unexpected acknowledgment from {self._peer_username(peer_socket)}: {ack}")
+            return
+        if ack['status'] == 'success':
+            sent.delivered = True
+            self._record_history(sent.peer_username, sent.entry)
+            logger.info(f"Message sent to {sent.peer_username} and acknowledged")
+        else:
+            logger.error(f"Message to {sent.peer_username} not acknowledged: {ack.get('message')}")
+        sent.event.set()
+
+    def _close_watched_socket(self, peer_socket: socket.socket):
+        """Remove a peer socket from the event loop and close it"""
+        try:
+            self._loop.remove_reader(peer_socket)
+            self._loop.remove_writer(peer_socket)
+        except ValueError:
+            pass
+        try:
+            peer_socket.close()
+        except OSError:
+            pass
+
+    def _drop_incoming_peer(self, peer_username: str) -> bool:
+        """Close the connection a peer opened to us, if there is one"""
+        writer = self.incoming_peers.pop(peer_username, None)
+        if writer is None:
+            return False
+        try:
+            self._loop.call_soon_threadsafe(writer.close)
+        except RuntimeError:
+            pass
+        return True
+
+    def _run_event_loop(self):
+        """Thread function running the event loop that receives connections and messages from peers"""
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._serve())
+        except Exception as e:
+            logger.error(f"Error in receive event loop: {e}")
+        finally:
+            self._loop.close()
+
+    async def _serve(self):
+        """Accept peer connections on the event loop until the client shuts down"""
+        server = await asyncio.start_server(self._on_peer, sock=self.socket)
         while self.running:
+            # Wake once a second to check self.running and close idle connections
+            await asyncio.sleep(1.0)
+            self._close_idle_peers()
+        server.close()
+
+        # Stop the handlers of connections that are still open; each closes its own stream
+        handlers = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in handlers:
+            task.cancel()
+        await asyncio.gather(*handlers, return_exceptions=True)
+        for peer_socket in list(self._peer_connections):
+            self._close_watched_socket(peer_socket)
+
+    async def _on_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Handle a connection a peer opened to us: its connection request, then each message it sends
+        """
+        address = writer.get_extra_info('peername')
+        # asyncio already sets TCP_NODELAY on accepted sockets; this adds keepalive
+        _tune_tcp_socket(writer.get_extra_info('socket'))
+        peer_username = None
+        try:
+            logger.info(f"Handling incoming connection from {address}")
             try:
-                # Create a list of sockets to check for activity
-                sockets_to_check = [self.socket] + list(self.connected_peers.keys())
-                
-                # Use select to check for activity without blocking
-                readable, _, _ = select.select(sockets_to_check, [], [], 1.0)
-                
-                for sock in readable:
-                    if sock == self.socket:
-                        try:
-                            # New connection
-                            client_socket, address = sock.accept()
-                            logger.info(f"New connection accepted from {address}")
-                            threading.Thread(
-                                target=self._handle_incoming_connection,
-                                args=(client_socket, address)
-                            ).start()
-                        except Exception as e:
-                            logger.error(f"Error accepting new connection: {e}")
-                    else:
-                        # Message from connected peer
-                        try:
-                            data = sock.recv(4096).decode('utf-8')
-                            if not data:
-                                # Connection closed by peer
-                                peer_username, _ = self.connected_peers[sock]
-                                logger.info(f"Connection closed by peer {peer_username}")
-                                # Remove from connected_peers to prevent further attempts to use this socket
-                                del self.connected_peers[sock]
-                                sock.close()
-                            else:
-                                # Handle message
-                                self._handle_message(sock, data)
-                        except Exception as e:
-                            # Handle broken connections
-                            try:
-                                peer_username, _ = self.connected_peers[sock]
-                                logger.info(f"Connection to {peer_username} is broken")
-                                # Remove from connected_peers to prevent further attempts to use this socket
-                                del self.connected_peers[sock]
-                                sock.close()
-                            except:
-                                # If we can't get the peer username, just close the socket
-                                try:
-                                    sock.close()
-                                except:
-                                    pass
+                request = await asyncio.wait_for(read_frame(reader), 5)
+            except asyncio.TimeoutError:
+                logger.error(f"Timeout waiting for connection request from {address}")
+                return
+            if request is None:
+                raise ConnectionError("connection closed before connection request")
+            
+            logger.debug("Received connection request from %s: %s", address, request)
+            rejection = self._accept_peer(request, address)
+            if rejection is not None:
+                writer.write(encode_frame(rejection))
+                await writer.drain()
+                return
+            writer.write(timestamped_frame(ACCEPT_PREFIX))
+            await writer.drain()
+            
+            peer_username = request['username']
+            previous = self.incoming_peers.get(peer_username)
+            if previous is not None:
+                previous.close()
+            self.incoming_peers[peer_username] = writer
+            
+            while self.running:
+                message_data = await read_frame(reader)
+                if message_data is None:
+                    # Connection closed by peer
+                    logger.info(f"Connection closed by peer {peer_username}")
+                    break
+                if self._handle_message(peer_username, address, message_data):
+                    logger.debug("Sending acknowledgment to %s", peer_username)
+                    writer.write(timestamped_frame(ACK_PREFIX))
+                    await writer.drain()
+        except Exception as e:
+            logger.error(f"Error handling connection from {address}: {e}")
+        finally:
+            if peer_username is not None and self.incoming_peers.get(peer_username) is writer:
+                del self.incoming_peers[peer_username]
+            writer.close()
+
+    def _on_peer_readable(self, peer_socket: socket.socket):
+        """Event loop callback for data arriving on a peer socket we opened"""
+        conn = self._peer_connections.get(peer_socket)
+        if conn is None:
+            # Already forgotten; the loop stops watching it on its next pass
+            return
+        peer_username = conn.username
+        self._touch_peer_socket(peer_socket)
+        try:
+            # Only what has arrived is taken, into the socket's preallocated buffer, so a
+            # partly received frame never holds up the event loop
+            bodies = conn.receive()
+        except (BlockingIOError, InterruptedError, socket.timeout):
+            return
+        except OSError:
+            # Handle broken connections
+            logger.info(f"Connection to {peer_username} is broken")
+            self._forget_peer_socket(peer_socket)
+            return
+        if bodies is None:
+            # Connection closed by peer
+            logger.info(f"Connection closed by peer {peer_username}")
+            self._forget_peer_socket(peer_socket)
+            return
+        
+        for body in bodies:
+            try:
+                message_data = decode_payload(body)
+            except ValueError as e:
+                logger.error(f"Error decoding message from {peer_username}: {e}")
+                continue
+            if 'status' in message_data:
+                # The acknowledgment of a message we sent on this connection
+                self._settle_ack(peer_socket, message_data)
+                continue
+            if self._handle_message(peer_username, conn.address, message_data):
+                # Written once the socket can take it, so a peer that stops reading never blocks the loop
+                logger.debug("Queueing acknowledgment to %s", peer_username)
+                conn.outbox += timestamped_frame(ACK_PREFIX)
+                if len(conn.outbox) > MAX_FRAME_SIZE:
+                    logger.error(f"{peer_username} is not reading its acknowledgments, closing the connection")
+                    self._forget_peer_socket(peer_socket)
+                    return
+                self._watch_peer_writable(peer_socket)
+
+    def _watch_peer_writable(self, peer_socket: socket.socket):
+        """Have the event loop send a peer socket's queued acknowledgments once it is writable"""
+        # The connection may have been closed since the acknowledgments were queued
+        if peer_socket in self._peer_connections:
+            self._loop.add_writer(peer_socket, self._on_peer_writable, peer_socket)
+
+    def _on_peer_writable(self, peer_socket: socket.socket):
+        """Event loop callback sending queued acknowledgments on a peer socket we opened"""
+        conn = self._peer_connections.get(peer_socket)
+        if conn is None:
+            return
+        if not conn.send_lock.acquire(blocking=False):
+            # send_message is writing to this socket; it hands the queue back to the loop when it is done
+            self._loop.remove_writer(peer_socket)
+            return
+        try:
+            # The socket is writable, so this returns at once even though it has a timeout
+            sent = peer_socket.send(conn.outbox)
+            del conn.outbox[:sent]
+        except (BlockingIOError, InterruptedError, socket.timeout):
+            return
+        except OSError as e:
+            logger.error(f"Error sending acknowledgment to {conn.username}: {e}")
+            self._forget_peer_socket(peer_socket)
+            return
+        finally:
+            conn.send_lock.release()
+        if not conn.outbox:
+            self._loop.remove_writer(peer_socket)
+    
+    def _get_local_ip(self) -> str:
+        """
+        Get the IP address other machines reach this peer at, looking it up only once
+
+        Returns:
+            str: The outbound IP address, or 127.0.0.1 if it cannot be determined
+        """
+        if self._cached_local_ip is None:
+            try:
+                # Connecting a UDP socket sends nothing but makes the OS pick the outbound interface
+                temp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                try:
+                    temp_socket.connect(('8.8.8.8', 80))  # Connect to a public IP
+                    self._cached_local_ip = temp_socket.getsockname()[0]
+                finally:
+                    temp_socket.close()
+                logger.info(f"Using actual IP address {self._cached_local_ip}")
             except Exception as e:
-                logger.error(f"Error in receive messages loop: {e}")
-                time.sleep(1)  # Prevent tight loop on persistent errors
+                # Not cached, so the lookup is tried again next time
+                logger.warning(f"Could not determine actual IP address: {e}")
+                return '127.0.0.1'  # Fallback to localhost
+        return self._cached_local_ip
+
+    def refresh_ip(self):
+        """Forget the cached IP address, e.g. after the machine changes networks"""
+        self._cached_local_ip = None
+
+    def _dir_request(self, request: Dict) -> Dict:
+        """
+        Send one request to the directory server over the shared connection and return its response
+        
+        The connection is opened on first use. If the server has dropped it since the last request,
+        it is reopened and the request sent once more.
+        """
+        with self._dir_lock:
+            if self._dir_sock is not None:
+                try:
+                    return self._dir_exchange(request)
+                except ConnectionError as e:
+                    logger.info(f"Directory server connection lost ({e}), reconnecting")
+            
+            dir_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            _tune_tcp_socket(dir_socket)
+            dir_socket.settimeout(5)  # Set a timeout for the connection and each response
+            try:
+                dir_socket.connect((self.directory_host, self.directory_port))
+            except Exception:
+                dir_socket.close()
+                raise
+            self._dir_sock = dir_socket
+            return self._dir_exchange(request)
+    
+    def _dir_exchange(self, request: Dict) -> Dict:
+        """Send a request on the open directory server connection and read its response, closing the connection on failure"""
+        try:
+            send_frame(self._dir_sock, request)
+            response = recv_frame(self._dir_sock)
+            if response is None:
+                raise ConnectionError("directory server closed the connection")
+            return response
+        except Exception:
+            self._close_dir_socket()
+            raise
+    
+    def _close_dir_socket(self):
+        """Close the directory server connection, if one is open"""
+        if self._dir_sock is not None:
+            try:
+                self._dir_sock.close()
+            except OSError:
+                pass
+            self._dir_sock = None
     
     def register_with_directory(self) -> Dict:
         """
@@ -340,28 +861,10 @@ class PeerClient:
         if not self.username:
             return {'status': 'error', 'message': 'Username not set'}
             
-        dir_socket = None
         try:
-            # Create a socket to connect to the directory server
-            dir_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            dir_socket.settimeout(5)  # Set a timeout for the connection
-            dir_socket.connect((self.directory_host, self.directory_port))
-            
             # Get the actual IP address for registration
             # If host is 0.0.0.0, we need to determine the actual IP address
-            registration_ip = self.host
-            if registration_ip == '0.0.0.0':
-                # Try to determine the actual IP address
-                try:
-                    # Create a temporary socket to get the local IP
-                    temp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                    temp_socket.connect(('8.8.8.8', 80))  # Connect to a public IP
-                    registration_ip = temp_socket.getsockname()[0]
-                    temp_socket.close()
-                    logger.info(f"Using actual IP address {registration_ip} for registration")
-                except Exception as e:
-                    logger.warning(f"Could not determine actual IP address: {e}")
-                    registration_ip = '127.0.0.1'  # Fallback to localhost
+            registration_ip = self._get_local_ip() if self.host == '0.0.0.0' else self.host
             
             # Prepare registration request
             request = {
@@ -375,12 +878,8 @@ class PeerClient:
                 }
             }
             
-            # Send request
-            dir_socket.send(json.dumps(request).encode('utf-8'))
-            
-            # Receive response
-            response_data = dir_socket.recv(4096).decode('utf-8')
-            response = json.loads(response_data)
+            # Send request and receive response
+            response = self._dir_request(request)
             
             # Check if the directory server reported a username conflict
             if response['status'] == 'error' and response.get('error_code') == 'username_taken':
@@ -389,7 +888,9 @@ class PeerClient:
             
             # Save profile after successful registration
             if response['status'] == 'success':
-                self._save_profile()
+                self._mark_dirty('profile')
+                # Our own entry changed, so cached results may be out of date
+                self._dir_cache.clear()
                 
             return response
         except socket.timeout:
@@ -401,13 +902,10 @@ class PeerClient:
         except Exception as e:
             logger.error(f"Error registering with directory: {e}")
             return {'status': 'error', 'message': str(e)}
-        finally:
-            if dir_socket:
-                try:
-                    dir_socket.shutdown(socket.SHUT_RDWR)
-                    dir_socket.close()
-                except:
-                    pass
+    
+    async def register_with_directory_async(self) -> Dict:
+        """Register with the directory server from a worker thread, so an event loop caller is not blocked"""
+        return await asyncio.to_thread(self.register_with_directory)
     
     def query_directory(self, query_type: str = 'all', search_term: str = '') -> Dict:
         """
@@ -420,13 +918,13 @@ class PeerClient:
         Returns:
             Dict: Response from the directory server
         """
-        dir_socket = None
-        try:
-            # Create a socket to connect to the directory server
-            dir_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            dir_socket.settimeout(5)  # Set a timeout for the connection
-            dir_socket.connect((self.directory_host, self.directory_port))
+        # Reuse a recent answer to the same query rather than opening another connection
+        key = (query_type, search_term)
+        cached = self._dir_cache.get(key)
+        if cached is not None and time.monotonic() - cached[0] < DIRECTORY_CACHE_TTL:
+            return cached[1]
             
+        try:
             # Prepare query request
             request = {
                 'action': 'query',
@@ -434,13 +932,11 @@ class PeerClient:
                 'search_term': search_term
             }
             
-            # Send request
-            dir_socket.send(json.dumps(request).encode('utf-8'))
-            
-            # Receive response
-            response_data = dir_socket.recv(4096).decode('utf-8')
-            response = json.loads(response_data)
+            # Send request and receive response
+            response = self._dir_request(request)
             
+            if response.get('status') == 'success':
+                self._dir_cache[key] = (time.monotonic(), response)
             return response
         except socket.timeout:
             logger.error("Timeout while connecting to directory server")
@@ -451,13 +947,14 @@ class PeerClient:
         except Exception as e:
             logger.error(f"Error querying directory: {e}")
             return {'status': 'error', 'message': str(e)}
-        finally:
-            if dir_socket:
-                try:
-                    dir_socket.shutdown(socket.SHUT_RDWR)
-                    dir_socket.close()
-                except:
-                    pass
+    
+    async def query_directory_async(self, query_type: str = 'all', search_term: str = '') -> Dict:
+        """Query the directory server from a worker thread, so an event loop caller is not blocked"""
+        return await asyncio.to_thread(self.query_directory, query_type, search_term)
+    
+    def _invalidate_directory_cache(self, peer_username: str):
+        """Drop the cached lookup of a peer whose address just failed, so the next attempt asks the server"""
+        self._dir_cache.pop(('name', peer_username), None)
     
     def connect_to_peer(self, peer_username: str) -> bool:
         """
@@ -480,20 +977,21 @@ class PeerClient:
             return False
             
         # Check if peer is muted
-        if peer_username in self.muted_users:
-            if datetime.datetime.now() < self.muted_users[peer_username]:
+        mute_expiry = self.muted_users.get(peer_username)
+        if mute_expiry is not None:
+            if datetime.datetime.now() < mute_expiry:
                 logger.warning(f"Cannot connect to muted user {peer_username}")
                 return False
             else:
-                # Mute has expired, remove it
-                self.muted_users.remove(peer_username)
-                self._save_profile()
+                # Mute has expired, remove it; the mute sweep may have just done so
+                self.muted_users.pop(peer_username, None)
+                self._mark_dirty('profile')
         
         try:
             # First check if peer is in local directory
             if peer_username in self.local_directory:
                 peer_info = self.local_directory[peer_username]
-                logger.info(f"Found {peer_username} in local directory: {peer_info}")
+                logger.debug("Found %s in local directory: %s", peer_username, peer_info)
                 
                 # Check if the peer has been seen recently (within the last 5 minutes)
                 last_seen = peer_info.get('last_seen')
@@ -547,22 +1045,13 @@ class PeerClient:
                 peer_port = peer_info['port']
             
             # Get our own IP and port for logging
-            our_ip = self.host
-            if our_ip == '0.0.0.0':
-                try:
-                    # Create a temporary socket to get the local IP
-                    temp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                    temp_socket.connect(('8.8.8.8', 80))  # Connect to a public IP
-                    our_ip = temp_socket.getsockname()[0]
-                    temp_socket.close()
-                except Exception as e:
-                    logger.warning(f"Could not determine our IP address: {e}")
-                    our_ip = '127.0.0.1'  # Fallback to localhost
+            our_ip = self._get_local_ip() if self.host == '0.0.0.0' else self.host
             
             logger.info(f"Attempting to connect to {peer_username} at {peer_ip}:{peer_port} from {our_ip}:{self.port}")
             
             # Create a socket to connect to the peer
             peer_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            _tune_tcp_socket(peer_socket)
             peer_socket.settimeout(5)  # Set a timeout for the connection
             
             try:
@@ -577,24 +1066,25 @@ class PeerClient:
                     'timestamp': datetime.datetime.now().isoformat()
                 }
                 
-                logger.info(f"Sending connection request to {peer_username}: {request}")
-                peer_socket.send(json.dumps(request).encode('utf-8'))
+                logger.debug("Sending connection request to %s: %s", peer_username, request)
+                send_frame(peer_socket, request)
                 
                 # Wait for response
                 logger.info(f"Waiting for connection response from {peer_username}")
-                response_data = peer_socket.recv(4096).decode('utf-8')
-                response = json.loads(response_data)
+                response = recv_frame(peer_socket)
+                if response is None:
+                    raise ConnectionError("connection closed before response")
                 
-                logger.info(f"Received connection response from {peer_username}: {response}")
+                logger.debug("Received connection response from %s: %s", peer_username, response)
                 
                 if response['status'] != 'success':
                     logger.error(f"Connection to {peer_username} failed: {response['message']}")
                     peer_socket.close()
+                    self._invalidate_directory_cache(peer_username)
                     return False
                     
                 # Store the connection
-                self.connected_peers[peer_socket] = (peer_username, (peer_ip, peer_port))
-                self.peer_usernames[peer_socket] = peer_username
+                self._track_peer_socket(peer_socket, peer_username, (peer_ip, peer_port))
                 
                 logger.info(f"Successfully connected to {peer_username}")
                 return True
@@ -602,30 +1092,42 @@ class PeerClient:
             except socket.timeout:
                 logger.error(f"Timeout connecting to {peer_username}")
                 peer_socket.close()
+                self._invalidate_directory_cache(peer_username)
                 return False
             except ConnectionRefusedError:
                 logger.error(f"Connection refused by {peer_username}")
                 peer_socket.close()
+                self._invalidate_directory_cache(peer_username)
                 return False
             except Exception as e:
                 logger.error(f"Error connecting to {peer_username}: {e}")
                 peer_socket.close()
+                self._invalidate_directory_cache(peer_username)
                 return False
                 
         except Exception as e:
             logger.error(f"Error connecting to peer {peer_username}: {e}")
             return False
     
-    def send_message(self, peer_username: str, message: str) -> bool:
+    async def connect_to_peer_async(self, peer_username: str) -> bool:
+        """Connect to a peer from a worker thread, so an event loop caller is not blocked for the connect timeout"""
+        return await asyncio.to_thread(self.connect_to_peer, peer_username)
+    
+    def send_message(self, peer_username: str, message: str, confirm: bool = False) -> bool:
         """
         Send a message to a peer
         
+        The message is written to the peer's connection without waiting for it to be acknowledged,
+        so many messages can be in flight at once. Its acknowledgment is matched up by the receive
+        loop, which then records the message in the history.
+        
         Args:
             peer_username: Username of the peer to send the message to
             message: Message content
+            confirm: Wait up to ACK_TIMEOUT seconds for the peer to acknowledge the message
             
         Returns:
-            bool: True if message was sent successfully, False otherwise
+            bool: True if message was sent (and, with confirm, acknowledged), False otherwise
         """
         # Check if peer is blocked
         if peer_username in self.blocked_users:
@@ -633,33 +1135,29 @@ class PeerClient:
             return False
             
         # Check if peer is muted
-        if peer_username in self.muted_users:
-            if datetime.datetime.now() < self.muted_users[peer_username]:
+        mute_expiry = self.muted_users.get(peer_username)
+        if mute_expiry is not None:
+            if datetime.datetime.now() < mute_expiry:
                 logger.warning(f"Cannot send message to muted user {peer_username}")
                 return False
             else:
-                # Mute has expired, remove it
-                self.muted_users.remove(peer_username)
-                self._save_profile()
+                # Mute has expired, remove it; the mute sweep may have just done so
+                self.muted_users.pop(peer_username, None)
+                self._mark_dirty('profile')
         
         try:
             # Connect to the peer if not already connected
-            if peer_username not in self.peer_usernames.values():
-                logger.info(f"Not connected to {peer_username}, attempting to connect...")
+            peer_socket = self._peer_socket(peer_username)
+            if peer_socket is None:
+                logger.debug("Not connected to %s, attempting to connect...", peer_username)
                 if not self.connect_to_peer(peer_username):
                     logger.error(f"Failed to connect to {peer_username}, cannot send message")
                     return False
                 else:
-                    logger.info(f"Successfully connected to {peer_username}, proceeding to send message")
+                    logger.debug("Successfully connected to %s, proceeding to send message", peer_username)
+                peer_socket = self._peer_socket(peer_username)
             else:
-                logger.info(f"Already connected to {peer_username}, proceeding to send message")
-                    
-            # Find the peer's socket
-            peer_socket = None
-            for sock, username in self.peer_usernames.items():
-                if username == peer_username:
-                    peer_socket = sock
-                    break
+                logger.debug("Already connected to %s, proceeding to send message", peer_username)
                     
             if peer_socket is None:
                 logger.error(f"Could not find socket for {peer_username}")
@@ -673,54 +1171,35 @@ class PeerClient:
                 'timestamp': datetime.datetime.now().isoformat()
             }
             
-            # Send message with timeout
-            try:
-                logger.info(f"Preparing to send message to {peer_username}: {message_data}")
-                peer_socket.settimeout(5)
-                logger.info(f"Sending message data to {peer_username}")
-                peer_socket.send(json.dumps(message_data).encode('utf-8'))
-                
-                # Wait for acknowledgment
-                logger.info(f"Waiting for acknowledgment from {peer_username}")
-                ack_data = peer_socket.recv(4096).decode('utf-8')
-                ack = json.loads(ack_data)
-                
-                logger.info(f"Received acknowledgment from {peer_username}: {ack}")
-                
-                if ack['status'] != 'success':
-                    logger.error(f"Message to {peer_username} not acknowledged: {ack['message']}")
-                    return False
-                    
-                logger.info(f"Message sent to {peer_username} and acknowledged")
-                
-                # Store message in history
-                if peer_username not in self.message_history:
-                    self.message_history[peer_username] = []
-                    
-                self.message_history[peer_username].append({
-                    'direction': 'outgoing',
-                    'content': message,
-                    'timestamp': datetime.datetime.now().isoformat()
-                })
-                
-                # Save message history
-                self._save_history()
-                
-                # Close the connection after successful message delivery
-                logger.info(f"Closing connection to {peer_username} after successful message delivery")
-                peer_socket.close()
-                del self.connected_peers[peer_socket]
-                del self.peer_usernames[peer_socket]
-                
-                return True
-            except socket.timeout:
-                logger.error(f"Timeout waiting for acknowledgment from {peer_username}")
-                # Don't remove the connection, just return False
+            # Queue the acknowledgment before sending, so it cannot arrive before it is expected
+            sent = PendingAck(peer_username, {
+                'direction': 'outgoing',
+                'content': message,
+                'timestamp': message_data['timestamp']
+            })
+            conn = self._peer_connections.get(peer_socket)
+            if conn is None or not self._expect_ack(peer_socket, sent):
+                logger.error(f"Connection to {peer_username} was closed before the message could be sent")
                 return False
+            try:
+                logger.debug("Sending message to %s: %s", peer_username, message_data)
+                # Acknowledgments the loop is writing to the same socket must not be interleaved with the frame
+                with conn.send_lock:
+                    send_frame(peer_socket, message_data)
             except (socket.error, ConnectionError) as e:
                 logger.error(f"Error sending message to {peer_username}: {e}")
-                # Don't remove the connection, just return False
+                self._forget_peer_socket(peer_socket)
                 return False
+            if conn.outbox:
+                # The loop stopped writing acknowledgments while the frame was being sent
+                self._loop.call_soon_threadsafe(self._watch_peer_writable, peer_socket)
+            
+            if not confirm:
+                return True
+            if not sent.event.wait(ACK_TIMEOUT):
+                logger.error(f"Timeout waiting for acknowledgment from {peer_username}")
+                return False
+            return sent.delivered
             
         except Exception as e:
             logger.error(f"Error sending message to {peer_username}: {e}")
@@ -743,14 +1222,13 @@ class PeerClient:
                 self.blocked_users.add(peer_username)
                 
                 # Close connection if exists
-                if peer_username in self.connected_peers:
-                    peer_socket, _ = self.connected_peers[peer_socket]
-                    peer_socket.close()
-                    del self.connected_peers[peer_socket]
-                    del self.peer_usernames[peer_socket]
+                peer_socket = self._peer_socket(peer_username)
+                if peer_socket is not None:
+                    self._forget_peer_socket(peer_socket)
+                self._drop_incoming_peer(peer_username)
                 
                 # Save profile
-                self._save_profile()
+                self._mark_dirty('profile')
                 
                 logger.info(f"User {peer_username} blocked")
                 return True
@@ -777,10 +1255,10 @@ class PeerClient:
             expiry_time = datetime.datetime.now() + datetime.timedelta(hours=hours)
             
             # Add or update mute
-            self.muted_users.add(peer_username)
+            self.muted_users[peer_username] = expiry_time
             
             # Save profile
-            self._save_profile()
+            self._mark_dirty('profile')
             
             logger.info(f"User {peer_username} muted for {hours} hours")
             return True
@@ -788,190 +1266,131 @@ class PeerClient:
             logger.error(f"Error muting user {peer_username}: {e}")
             return False
     
-    def _handle_incoming_connection(self, client_socket: socket.socket, address: tuple):
+    def _accept_peer(self, request: Dict, address: tuple) -> Optional[Dict]:
         """
-        Handle an incoming connection
+        Decide whether to accept an incoming connection request
         
         Args:
-            client_socket: Socket of the incoming connection
+            request: Decoded connection request
             address: Address of the incoming connection
-        """
-        try:
-            logger.info(f"Handling incoming connection from {address}")
-            
-            # Set a timeout for receiving the connection request
-            client_socket.settimeout(5)
-            
-            # Receive connection request
-            logger.info(f"Waiting for connection request from {address}")
-            data = client_socket.recv(4096).decode('utf-8')
-            request = json.loads(data)
             
-            # Reset timeout
-            client_socket.settimeout(None)
-            
-            logger.info(f"Received connection request from {address}: {request}")
-            
-            if request['action'] != 'connect':
-                logger.warning(f"Invalid connection request from {address}: {request}")
-                response = {
-                    'status': 'error',
-                    'message': 'Invalid connection request'
-                }
-                logger.info(f"Sending error response to {address}: {response}")
-                client_socket.send(json.dumps(response).encode('utf-8'))
-                # Don't close the socket
-                return
-                
-            peer_username, _ = self.connected_peers[client_socket]
-            logger.info(f"Connection request from peer {peer_username} at {address}")
-            
-            # Check if peer is blocked
-            if peer_username in self.blocked_users:
-                logger.warning(f"Connection from blocked user {peer_username} rejected")
-                response = {
-                    'status': 'error',
-                    'message': 'Connection rejected: user is blocked'
-                }
-                logger.info(f"Sending rejection response to {peer_username}: {response}")
-                client_socket.send(json.dumps(response).encode('utf-8'))
-                # Don't close the socket
-                return
-                
-            # Check if peer is muted
-            if peer_username in self.muted_users:
-                if datetime.datetime.now() < self.muted_users[peer_username]:
-                    logger.warning(f"Connection from muted user {peer_username} rejected")
-                    response = {
-                        'status': 'error',
-                        'message': 'Connection rejected: user is muted'
-                    }
-                    logger.info(f"Sending rejection response to {peer_username}: {response}")
-                    client_socket.send(json.dumps(response).encode('utf-8'))
-                    # Don't close the socket
-                    return
-                else:
-                    # Mute has expired, remove it
-                    logger.info(f"Mute for {peer_username} has expired, removing")
-                    self.muted_users.remove(peer_username)
-                    self._save_profile()
-            
-            # Accept connection with standardized response format
-            response = {
-                'status': 'success',
-                'message': 'Connection accepted',
-                'timestamp': datetime.datetime.now().isoformat()
+        Returns:
+            Dict: The error response to send to the peer, or None if the connection is accepted
+        """
+        if request.get('action') != 'connect' or 'username' not in request:
+            logger.warning(f"Invalid connection request from {address}: {request}")
+            return {
+                'status': 'error',
+                'message': 'Invalid connection request'
             }
             
-            logger.info(f"Sending connection acceptance to {peer_username}: {response}")
-            client_socket.send(json.dumps(response).encode('utf-8'))
-            
-            # Store the connection
-            self.connected_peers[client_socket] = (peer_username, address)
-            self.peer_usernames[client_socket] = peer_username
-            
-            # Get the actual IP address of the peer
-            peer_ip, peer_port = address
-            
-            logger.info(f"Stored connection to {peer_username} at {peer_ip}:{peer_port}")
+        peer_username = request['username']
+        logger.info(f"Connection request from peer {peer_username} at {address}")
+        # One clock read serves the mute check and the directory entry
+        now = datetime.datetime.now()
+        
+        # Check if peer is blocked
+        if peer_username in self.blocked_users:
+            logger.warning(f"Connection from blocked user {peer_username} rejected")
+            return {
+                'status': 'error',
+                'message': 'Connection rejected: user is blocked'
+            }
             
-            # Add to local directory if not already there
-            if peer_username not in self.local_directory:
-                # Create a basic user info entry
-                user_info = {
-                    'username': peer_username,
-                    'ip': peer_ip,
-                    'port': peer_port,
-                    'last_seen': datetime.datetime.now().isoformat()
+        # Check if peer is muted
+        mute_expiry = self.muted_users.get(peer_username)
+        if mute_expiry is not None:
+            if now < mute_expiry:
+                logger.warning(f"Connection from muted user {peer_username} rejected")
+                return {
+                    'status': 'error',
+                    'message': 'Connection rejected: user is muted'
                 }
-                logger.info(f"Adding {peer_username} to local directory: {user_info}")
-                self.add_to_local_directory(user_info)
             else:
-                # Update existing entry with latest information
-                logger.info(f"Updating {peer_username} in local directory with latest information")
-                self.local_directory[peer_username]['ip'] = peer_ip
-                self.local_directory[peer_username]['port'] = peer_port
-                self.local_directory[peer_username]['last_seen'] = datetime.datetime.now().isoformat()
-                self._save_directory()
-            
-            logger.info(f"Successfully connected to {peer_username}")
-        except socket.timeout:
-            logger.error(f"Timeout waiting for connection request from {address}")
-            # Don't close the socket
-        except Exception as e:
-            logger.error(f"Error handling incoming connection from {address}: {e}")
-            # Don't close the socket
+                # Mute has expired, remove it
+                logger.info(f"Mute for {peer_username} has expired, removing")
+                self.muted_users.pop(peer_username, None)
+                self._mark_dirty('profile')
+        
+        # Get the actual IP address of the peer
+        peer_ip, peer_port = address[:2]
+        
+        # Add to local directory if not already there
+        if peer_username not in self.local_directory:
+            # Create a basic user info entry
+            user_info = {
+                'username': peer_username,
+                'ip': peer_ip,
+                'port': peer_port,
+                'last_seen': now.isoformat()
+            }
+            logger.info(f"Adding {peer_username} to local directory: {user_info}")
+            self.add_to_local_directory(user_info)
+        else:
+            # Update existing entry with latest information
+            logger.info(f"Updating {peer_username} in local directory with latest information")
+            self.local_directory[peer_username]['ip'] = peer_ip
+            self.local_directory[peer_username]['port'] = peer_port
+            self.local_directory[peer_username]['last_seen'] = now.isoformat()
+            self._mark_dirty('directory')
+        
+        logger.info(f"Successfully connected to {peer_username}")
+        return None
     
-    def _handle_message(self, peer_socket: socket.socket, data: str):
+    def _handle_message(self, peer_username: str, address: tuple, message_data: Dict) -> bool:
         """
         Handle an incoming message
         
         Args:
-            peer_socket: Socket of the peer that sent the message
-            data: Message data
+            peer_username: Username of the peer that sent the message
+            address: Address of the peer's connection
+            message_data: Decoded message
+            
+        Returns:
+            bool: True if the message was accepted and should be acknowledged
         """
         try:
-            message_data = json.loads(data)
-            
-            if message_data['action'] != 'message':
-                logger.warning(f"Invalid message from {self.peer_usernames[peer_socket]}")
-                return
+            if message_data.get('action') != 'message':
+                logger.warning(f"Invalid message from {peer_username}")
+                return False
                 
-            peer_username, _ = self.connected_peers[peer_socket]
             content = message_data['content']
             timestamp = message_data['timestamp']
+            peer_ip, peer_port = address[:2]
             
             # Add sender to local directory if not already there
             if peer_username not in self.local_directory:
                 # Create a basic user info entry
                 user_info = {
                     'username': peer_username,
-                    'ip': peer_socket.getpeername()[0],
-                    'port': peer_socket.getpeername()[1],
+                    'ip': peer_ip,
+                    'port': peer_port,
                     'last_seen': timestamp
                 }
                 self.add_to_local_directory(user_info)
             else:
                 # Update existing entry with latest information
                 self.local_directory[peer_username]['last_seen'] = timestamp
-                self.local_directory[peer_username]['ip'] = peer_socket.getpeername()[0]
-                self.local_directory[peer_username]['port'] = peer_socket.getpeername()[1]
-                self._save_directory()
+                self.local_directory[peer_username]['ip'] = peer_ip
+                self.local_directory[peer_username]['port'] = peer_port
+                self._mark_dirty('directory')
             
             # Store message in history
-            if peer_username not in self.message_history:
-                self.message_history[peer_username] = []
-                
-            self.message_history[peer_username].append({
+            self._record_history(peer_username, {
                 'direction': 'incoming',
                 'content': content,
                 'timestamp': timestamp
             })
             
-            # Save message history
-            self._save_history()
-            
-            # Send acknowledgment with standardized format
-            ack = {
-                'status': 'success',
-                'message': 'Message received',
-                'timestamp': datetime.datetime.now().isoformat()
-            }
-            
-            logger.info(f"Sending acknowledgment to {peer_username}")
-            try:
-                peer_socket.send(json.dumps(ack).encode('utf-8'))
-                logger.info(f"Acknowledgment sent to {peer_username}")
-            except Exception as e:
-                logger.error(f"Error sending acknowledgment to {peer_username}: {e}")
-            
             # Print message if not in test mode
             if not self.test_mode:
                 print(f"\n[{peer_username}] {content}")
                 
             logger.info(f"Message received from {peer_username}")
+            return True
         except Exception as e:
-            logger.error(f"Error handling message from {self.peer_usernames[peer_socket]}: {e}")
+            logger.error(f"Error handling message from {peer_username}: {e}")
+            return False
     
     def disconnect_from_peer(self, peer_username: str) -> bool:
         """
@@ -984,12 +1403,10 @@ class PeerClient:
             bool: True if disconnection was successful, False otherwise
         """
         try:
-            if peer_username in self.connected_peers:
-                peer_socket, _ = self.connected_peers[peer_username]
-                peer_socket.close()
-                del self.connected_peers[peer_socket]
-                del self.peer_usernames[peer_socket]
-                
+            peer_socket = self._peer_socket(peer_username)
+            if peer_socket is not None:
+                self._forget_peer_socket(peer_socket)
+            if self._drop_incoming_peer(peer_username) or peer_socket is not None:
                 logger.info(f"Disconnected from {peer_username}")
                 return True
             else:
@@ -1001,8 +1418,8 @@ class PeerClient:
     
     def disconnect_from_all_peers(self):
         """Disconnect from all peers"""
-        for peer_socket in list(self.connected_peers.keys()):
-            self.disconnect_from_peer(self.peer_usernames[peer_socket])
+        for peer_username in list(self.connected_peers) + list(self.incoming_peers):
+            self.disconnect_from_peer(peer_username)
     
     def shutdown(self):
         """Shutdown the peer client"""
@@ -1023,15 +1440,19 @@ class PeerClient:
         if hasattr(self, 'listener_monitor_thread') and self.listener_monitor_thread.is_alive():
             logger.info("Waiting for listener monitor thread to finish...")
             self.listener_monitor_thread.join(timeout=5)
+            
+        if hasattr(self, 'history_thread') and self.history_thread.is_alive():
+            logger.info("Waiting for history thread to finish...")
+            self.history_thread.join(timeout=5)
         
-        # Shutdown the listener process
-        if hasattr(self, 'listener_process') and self.listener_process and self.listener_process.is_alive():
-            logger.info("Shutting down listener process...")
-            self.listener_process.shutdown()
-            self.listener_process.join(timeout=5)
-            if self.listener_process.is_alive():
-                logger.warning("Listener process did not terminate gracefully, forcing termination")
-                self.listener_process.terminate()
+        # Fold this session's logged history into the snapshot file and write any pending changes
+        if self._history_log is not None:
+            self._save_history()
+        self._flush_dirty()
+        atexit.unregister(self._flush_dirty)
+        
+        # Shutdown the listener processes
+        self._stop_listener_processes()
         
         # Close the socket
         if hasattr(self, 'socket') and self.socket:
@@ -1039,6 +1460,8 @@ class PeerClient:
                 self.socket.close()
             except:
                 pass
+        with self._dir_lock:
+            self._close_dir_socket()
         
         # Close the message queue
         if hasattr(self, 'message_queue') and self.message_queue:
@@ -1095,124 +1518,159 @@ class PeerClient:
             logger.error(f"Error checking if peer {peer_username} is online: {e}")
             return False
     
+    def _create_message_queue(self):
+        """Create the channel the listener process forwards messages through"""
+        try:
+            return MessageRing()
+        except OSError as e:
+            logger.warning(f"Shared memory unavailable ({e}), using a multiprocessing queue for messages")
+            return multiprocessing.Queue(maxsize=MESSAGE_QUEUE_SIZE)
+
+    def _create_listener_process(self, port: int) -> ListenerProcess:
+        """Create and start one listener process sharing the message queue"""
+        listener = ListenerProcess(
+            host=self.host,
+            port=port,
+            username=self.username,
+            data_dir=self.data_dir,
+            message_queue=self.message_queue,
+            reuse_port=LISTENER_PROCESSES > 1
+        )
+        listener.start()
+        self.listener_processes.append(listener)
+        return listener
+    
     def start_listener_process(self):
-        """Start the listener process for handling incoming connections"""
+        """Start the listener processes for handling incoming connections"""
         logger.info("Starting listener process...")
         
         # Ensure message queue is initialized
         if not hasattr(self, 'message_queue') or self.message_queue is None:
             logger.info("Initializing message queue")
-            self.message_queue = multiprocessing.Queue()
+            self.message_queue = self._create_message_queue()
         
-        # Create and start the listener process
+        # Create and start the first listener process
         logger.info(f"Creating listener process with host={self.host}, port={self.port}, username={self.username}")
-        self.listener_process = ListenerProcess(
-            host=self.host,
-            port=self.port,
-            username=self.username,
-            data_dir=self.data_dir,
-            message_queue=self.message_queue
-        )
-        
-        logger.info("Starting listener process")
-        self.listener_process.start()
+        self.listener_processes = []
+        listener = self._create_listener_process(self.port)
         
         # Wait for the process to initialize and get the actual port
         logger.info("Waiting for listener process to initialize...")
         time.sleep(1)  # Give the process time to start
         
         if self.port == 0:  # If port was auto-assigned
-            self.port = self.listener_process.port
+            self.port = listener.bound_port.value
             logger.info(f"Listener process started on port {self.port}")
         else:
             logger.info(f"Listener process started on specified port {self.port}")
             
-        # Verify the process is running
-        if self.listener_process.is_alive():
-            logger.info("Listener process is running successfully")
+        # The rest bind the port the first one got, joining its SO_REUSEPORT group
+        if listener.bound_port.value:
+            for _ in range(LISTENER_PROCESSES - 1):
+                self._create_listener_process(listener.bound_port.value)
+            
+        # Verify the processes are running
+        if all(listener.is_alive() for listener in self.listener_processes):
+            logger.info(f"{len(self.listener_processes)} listener processes running successfully")
         else:
             logger.error("Listener process failed to start")
             
-        # Start a thread to monitor the listener process
-        self.listener_monitor_thread = threading.Thread(target=self._monitor_listener_process)
-        self.listener_monitor_thread.daemon = True
-        self.listener_monitor_thread.start()
+        # Start a thread to monitor the listener process; a restart is made by the monitor itself,
+        # which keeps running, so only the first start needs one
+        monitor = getattr(self, 'listener_monitor_thread', None)
+        if monitor is None or not monitor.is_alive():
+            self.listener_monitor_thread = threading.Thread(target=self._monitor_listener_process)
+            self.listener_monitor_thread.daemon = True
+            self.listener_monitor_thread.start()
         
     def _monitor_listener_process(self):
-        """Monitor the listener process and restart it if it goes offline"""
+        """Monitor the listener processes and restart them if one goes offline"""
         logger.info("Starting listener process monitor thread")
         while self.running:
             try:
-                # Check if the listener process is still alive
-                if not self.listener_process.is_alive():
+                # Sleep in the kernel until a listener process exits, waking only to check self.running
+                listeners = list(self.listener_processes)
+                multiprocessing.connection.wait([listener.sentinel for listener in listeners], timeout=LISTENER_MONITOR_INTERVAL)
+                if self.running and not all(listener.is_alive() for listener in listeners):
                     logger.warning("Listener process is not alive, attempting to restart...")
                     self.restart_listener_process()
-                
-                # Sleep for a bit before checking again
-                time.sleep(5)
             except Exception as e:
                 logger.error(f"Error monitoring listener process: {e}")
-                time.sleep(5)  # Sleep on error to prevent tight loop
+                time.sleep(LISTENER_MONITOR_INTERVAL)  # Sleep on error to prevent tight loop
                 
-    def restart_listener_process(self):
-        """Restart the listener process if it has gone offline"""
-        logger.info("Restarting listener process...")
-        
-        # Shutdown the existing process if it's still running
-        if hasattr(self, 'listener_process') and self.listener_process and self.listener_process.is_alive():
+    def _stop_listener_processes(self):
+        """Shut down every listener process that is still running"""
+        running = [listener for listener in getattr(self, 'listener_processes', ()) if listener.is_alive()]
+        # Signal them all before waiting on any, so they stop in parallel; SIGTERM makes a
+        # listener leave its loop and save pending history before it exits
+        for listener in running:
             try:
-                self.listener_process.shutdown()
-                self.listener_process.join(timeout=5)
-                if self.listener_process.is_alive():
-                    logger.warning("Listener process did not terminate gracefully, forcing termination")
-                    self.listener_process.terminate()
+                logger.info("Shutting down listener process...")
+                listener.shutdown()
+                listener.terminate()
             except Exception as e:
                 logger.error(f"Error shutting down listener process: {e}")
+        for listener in running:
+            listener.join(timeout=5)
+            if listener.is_alive():
+                logger.warning("Listener process did not terminate gracefully, forcing termination")
+                listener.kill()
+    
+    def restart_listener_process(self):
+        """Restart the listener processes if one has gone offline"""
+        logger.info("Restarting listener process...")
         
-        # Start a new listener process
-        self.start_listener_process()
+        # Shutdown the existing processes that are still running
+        self._stop_listener_processes()
+        
+        # Start new listener processes, unless the client shut down meanwhile
+        if self.running:
+            self.start_listener_process()
     
     def _handle_messages(self):
         """Handle messages from the listener process"""
         logger.info("Message handling thread started")
         while self.running:  # Use the running flag to control the loop
             try:
-                # Check for messages from the listener process
-                if not self.message_queue.empty():
-                    logger.info("Message found in queue, processing...")
-                    message = self.message_queue.get()
-                    logger.info(f"Retrieved message from queue: {message}")
-                    
-                    if message['type'] == 'message':
-                        # Update message history
-                        peer_username = message['from']
-                        logger.info(f"Processing message from {peer_username}")
-                        
-                        if peer_username not in self.message_history:
-                            self.message_history[peer_username] = []
-                        
-                        self.message_history[peer_username].append({
-                            'direction': 'incoming',
-                            'content': message['content'],
-                            'timestamp': message['timestamp']
-                        })
-                        
-                        # Save message history
-                        self._save_history()
-                        logger.info(f"Message history updated and saved for {peer_username}")
-                        
-                        # Print message if not in test mode
-                        if not self.test_mode:
-                            print(f"\n[{peer_username}] {message['content']}")
-                            logger.info(f"Message displayed to user: {message['content'][:50]}...")
-                    else:
-                        logger.warning(f"Received unknown message type: {message['type']}")
-                
-                time.sleep(0.1)  # Prevent tight loop
+                # Block until the listener process forwards something, rather than polling
+                # empty() and sleeping, so a message is handled as soon as it arrives
+                try:
+                    batch = self.message_queue.get(timeout=MESSAGE_WAIT_TIMEOUT)
+                except queue.Empty:
+                    continue
+                logger.debug("Retrieved message from queue: %s", batch)
+
+                # The listener forwards messages in lists; older listeners put them one at a time
+                if isinstance(batch, dict):
+                    batch = [batch]
+
+                for message in batch:
+                    self._handle_queued_message(message)
             except Exception as e:
                 logger.error(f"Error handling messages: {e}")
                 time.sleep(1)  # Prevent tight loop on errors
 
+    def _handle_queued_message(self, message: Dict):
+        """Handle one message forwarded by the listener process"""
+        if message['type'] == 'message':
+            # Update message history
+            peer_username = message['from']
+            logger.info(f"Processing message from {peer_username}")
+            
+            self._record_history(peer_username, {
+                'direction': 'incoming',
+                'content': message['content'],
+                'timestamp': message['timestamp']
+            })
+            logger.info(f"Message history updated for {peer_username}")
+            
+            # Print message if not in test mode
+            if not self.test_mode:
+                print(f"\n[{peer_username}] {message['content']}")
+                logger.info(f"Message displayed to user: {message['content'][:50]}...")
+        else:
+            logger.warning(f"Received unknown message type: {message['type']}")
+
 def interactive_mode(client: PeerClient):
     """
     Run the peer client in interactive mode
@@ -1471,8 +1929,8 @@ def interactive_mode(client: PeerClient):
             # Display connected peers
             print("\nConnected Peers:")
             if client.connected_peers:
-                for peer_socket, _ in client.connected_peers.values():
-                    print(f"- {client.peer_usernames[peer_socket]}")
+                for peer_username in client.connected_peers:
+                    print(f"- {peer_username}")
             else:
                 print("No connected peers")
                 
@@ -1563,8 +2021,7 @@ def load_or_create_profile() -> Tuple[str, str, int]:
                 username = profiles[choice - 1].replace('_profile.json', '')
                 profile_file = os.path.join(data_dir, profiles[choice - 1])
                 
-                with open(profile_file, 'r') as f:
-                    profile = json.load(f)
+                profile = _read_json(profile_file)
                     
                 # Check if the username might be taken
                 print(f"\nNote: If the username '{username}' is already taken by another user,")
@@ -10,7 +10,8 @@ from typing import Dict, List, Optional
 
 # Add the current directory to the path so we can import the directory_server
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from directory_server import DirectoryServer
+from directory_server import DirectoryServer, REGISTRY_FLUSH_INTERVAL, LOG_FLUSH_INTERVAL
+from framing import send_frame, recv_frame
 
 # Configure logging
 logging.basicConfig(
@@ -79,6 +80,8 @@ class DirectoryServerTest(unittest.TestCase):
         if self.server:
             self.server.users = {}
             self.server.ip_to_username = {}
+            self.server.ip_index = {}
+            self.server._snapshot = ({}, {})
             self.server._save_registry()
     
     def send_request(self, request: dict) -> dict:
@@ -86,9 +89,8 @@ class DirectoryServerTest(unittest.TestCase):
         client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
             client_socket.connect((self.server_host, self.server_port))
-            client_socket.send(json.dumps(request).encode('utf-8'))
-            response_data = client_socket.recv(4096).decode('utf-8')
-            return json.loads(response_data)
+            send_frame(client_socket, request)
+            return recv_frame(client_socket)
         finally:
             client_socket.close()
     
@@ -230,6 +232,9 @@ class DirectoryServerTest(unittest.TestCase):
         }
         
         self.send_request(request)
+
+        # Give the background flusher time to write the registration out
+        time.sleep(REGISTRY_FLUSH_INTERVAL + 0.5)
         
         # Verify the registry file was created
         self.assertTrue(os.path.exists(self.test_registry_file))
@@ -259,6 +264,9 @@ class DirectoryServerTest(unittest.TestCase):
         }
         
         self.send_request(request)
+
+        # Give the background log writer time to write the events out
+        time.sleep(LOG_FLUSH_INTERVAL + 0.5)
         
         # Verify log file was created
         self.assertTrue(os.path.exists(self.server.log_file))
@@ -280,6 +288,7 @@ class DirectoryServerTest(unittest.TestCase):
         }
         
         self.send_request(request)
+        time.sleep(LOG_FLUSH_INTERVAL + 0.5)
         
         # Read the log file again
         with open(self.server.log_file, 'r') as f:
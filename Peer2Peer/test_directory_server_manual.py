@@ -7,6 +7,7 @@ import time
 import threading
 import logging
 import argparse
+from framing import send_frame, recv_frame
 
 # Configure logging
 logging.basicConfig(
@@ -27,9 +28,8 @@ class DirectoryServerClient:
         client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
             client_socket.connect((self.host, self.port))
-            client_socket.send(json.dumps(request).encode('utf-8'))
-            response_data = client_socket.recv(4096).decode('utf-8')
-            return json.loads(response_data)
+            send_frame(client_socket, request)
+            return recv_frame(client_socket)
         finally:
             client_socket.close()
     